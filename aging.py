@@ -0,0 +1,147 @@
+import numpy as np
+import copy
+from concurrent.futures import ProcessPoolExecutor
+import profiling
+from character import Character, StatHistory, stream_key, stream_words, xp2val_array
+
+# ages many characters together. All characters are packed into one
+# (characters x stats) xp matrix, each row in its characters own column order
+# and padded with zero columns, with one row of priorities, softcaps and xp
+# options each, and every step advances all characters that need it by one
+# year with one weights calculation and one draw for all of them. Each
+# character draws from its own counter based stream keyed by its rng and the
+# year, so the result is the same as aging each character alone, whatever
+# other characters are aged with it and in what order
+class AgingEngine:
+    def __init__(self,
+                 characters: list,
+                 flush_every: int = 16, # years kept before writing to history
+                 ) -> None:
+        self.characters = list(characters)
+        self.flush_every = flush_every
+        self.width = [len(c.stats.index) for c in self.characters]
+        n_rows, n_stats = len(self.characters), max(self.width, default=0)
+        self.art = np.zeros((n_rows, n_stats), dtype=bool)
+        self.pri = np.zeros((n_rows, n_stats))
+        self.caps = np.full((n_rows, n_stats), np.inf)
+        for r, char in enumerate(self.characters):
+            index = char.stats.index
+            self.art[r, :len(index)] = index.art
+            self.pri[r, :len(index)] = [char.prios[name]
+                                        for name in index.names]
+            for name, cap in char.softcapped_stats.items():
+                if name in index.cols:
+                    self.caps[r, index.cols[name]] = cap
+        # only these columns need values for the softcap check
+        self.capped = np.flatnonzero(np.isfinite(self.caps).any(axis=0))
+        self.rel_art = np.array([c.rel_art_xp_weight for c in self.characters])
+        self.frac = np.array([c.frac_prio2xp_weight for c in self.characters])
+        self.budget = np.array([c.budget for c in self.characters],
+                               dtype=np.int64)
+        self.chunk_mean = np.array([c.chunk_mean for c in self.characters],
+                                   dtype=np.int64)
+        self.age_offset = np.array([c.char_input_age - c.char_input_year
+                                    for c in self.characters], dtype=np.int64)
+        self.keys = np.zeros((n_rows, 2), dtype=np.uint32)
+
+    def _weights(self, rows: np.ndarray, xp: np.ndarray) -> np.ndarray:
+        # same as Character._year_weights for every row
+        art = self.art[rows]
+        sts = xp.astype(np.float64)
+        capped = self.capped
+        vals = xp2val_array(xp[:, capped], art[:, capped])
+        sts[:, capped] = np.where(vals >= self.caps[rows][:, capped],
+                                  0, sts[:, capped])
+        sts = np.where(art, sts*self.rel_art[rows, None], np.minimum(sts, 75))
+        return Character.calc_weights(np.trunc(sts),
+                                      self.pri[rows],
+                                      self.frac[rows, None])
+
+    def _budgets(self, rows: np.ndarray, year: int) -> np.ndarray:
+        budget = self.budget[rows]
+        age = year + self.age_offset[rows]
+        slow = (budget*Character.slow_learning_factor).astype(np.int64)
+        return np.where(age > Character.slow_learning_age, slow, budget)
+
+    @profiling.profiled("AgingEngine.age_to")
+    def age_to(self, year: int) -> None:
+        # simulate all missing years up to year, does not move current year
+        n_rows = len(self.characters)
+        if n_rows == 0:
+            return
+        last = np.array([c.history.last_year for c in self.characters])
+        xp = np.zeros((n_rows, self.art.shape[1]), dtype=np.int64)
+        for r, char in enumerate(self.characters):
+            if last[r] < year:
+                char.history.resume(char.rng)
+                self.keys[r] = stream_key(char.rng.bit_generator.state)
+            xp[r, :self.width[r]] = char.history[last[r]].xp
+        buffer = []
+        cyear = int(last.min())
+        while cyear < year:
+            cyear += 1
+            rows = np.flatnonzero(last < cyear)
+            cur = xp[rows]
+            with profiling.stage("weights"):
+                weights = self._weights(rows, cur)
+            with profiling.stage("draw chunks"):
+                budgets = self._budgets(rows, cyear)
+                low = self.chunk_mean[rows] - self.chunk_mean[rows]//2
+                words = stream_words(self.keys[rows],
+                                     cyear,
+                                     int((-(-budgets//low)).max()))
+                cur += Character._draw_year(words,
+                                            budgets,
+                                            self.chunk_mean[rows],
+                                            weights)
+            xp[rows] = cur
+            buffer.append((rows, cur))
+            if len(buffer) >= self.flush_every:
+                self._flush(buffer)
+                buffer = []
+        self._flush(buffer)
+
+    @profiling.profiled("flush to histories")
+    def _flush(self, buffer: list) -> None:
+        # write buffered years to the characters histories, one extend each
+        if not buffer:
+            return
+        per_char = {}
+        for rows, cur in buffer:
+            for i, r in enumerate(rows.tolist()):
+                per_char.setdefault(r, []).append(cur[i])
+        for r, years in per_char.items():
+            block = np.stack(years)[:, :self.width[r]]
+            self.characters[r].history.extend(block)
+
+# runs in the pool workers, char only carries its last simulated year
+def _age_alone(char: Character, year: int) -> np.ndarray:
+    char.set_to_year(year)
+    return char.history.matrix[1:]
+
+# ages each character with set_to_year on its own rng in a process pool. Only
+# the last year of history is sent to the workers and the new years are sent
+# back, so the result is the same for any number of workers
+def age_in_pool(characters: list, year: int, workers: int) -> None:
+    todo = [c for c in characters
+            if c.history.last_year < year and not c.history.replays]
+    if not todo:
+        return
+    light = []
+    for char in todo:
+        c = copy.copy(char)
+        last = char.history.last_year
+        c.history = StatHistory(last, char.history[last], capacity=year-last+1)
+        light.append(c)
+    if workers == 1:
+        results = map(_age_alone, light, [year]*len(light))
+        return _write_back(todo, results)
+    chunksize = max(1, len(light)//(4*workers))
+    with ProcessPoolExecutor(workers) as pool:
+        results = pool.map(_age_alone, light, [year]*len(light),
+                           chunksize=chunksize)
+        _write_back(todo, results)
+
+def _write_back(characters: list, results) -> None:
+    for char, rows in zip(characters, results):
+        char.history.extend(rows)
@@ -1,230 +1,234 @@
 import numpy as np
 import tkinter as tk
-from tkinter import ttk, filedialog
+from tkinter import ttk, filedialog, messagebox
 import json
 from typing import List
 from character import Character, Ability, Art
 from character import dict2string as d2s
+from setting import Setting, swap_dict_values
+import storage
+import profiling
 import char_generator as cg
 from functools import partial
 import copy
 import lists_and_data
-import csv
-import inspect
-
-def wrapped_default(self, obj):
-    return getattr(obj.__class__, "__json__", wrapped_default.default)(obj)
-wrapped_default.default = json.JSONEncoder().default
-
-# apply the patch
-json.JSONEncoder.original_default = json.JSONEncoder.default
-json.JSONEncoder.default = wrapped_default
-
-def swap_dict_values(dct, a, b):
-    dct[a], dct[b] = dct[b], dct[a]
-
-class Setting:
-    def __init__(self,
-                 name: str,
-                 save_name: str,
-                 characters: dict = {},
-                 groups: dict = {},
-                 rng = None,
-                 current_year: int = 1220,
-                 frac_prio2xp_weight: float = None,
-                 rel_art_xp_weight: float = None,
-                 frac_art_prio_weight: float = None,
-                 budget: int = None,
-                 ability_ordering: dict = None,
-                 softcapped_stats: dict = None,
-                 ) -> None:
-        self.version = 0.4 # used to track how json save looks like and handle updates
-        self.name = name
-        self.save_name = save_name
-        self.characters = characters # contains all setting characters
-        # groups: Keys are group categories, like covenant or house, values
-        # are possibly dicts themselves with a name as key for each group in
-        # the category and other info about the group in that dict
-        # for now we track group membership on the characters, but we should
-        # make sure that all groups on characters exist here (or that we only
-        # add a group to a character from this dict of options)
-        self.groups = groups
-        self.rng = np.random.default_rng()
-        self.current_year = current_year
-        if ability_ordering is None:
-            self.ability_ordering = copy.deepcopy(lists_and_data.DEFAULT_ABIL_ORDERING)
-        else:
-            self.ability_ordering = ability_ordering
-        if rng is None:
-            self.rng = np.random.default_rng()
-        else:
-            self.rng = rng
-        d_char_v = inspect.signature(Character.__init__).parameters
-        if frac_prio2xp_weight is None:
-            self.frac_prio2xp_weight = d_char_v["frac_prio2xp_weight"].default
-        else:
-            self.frac_prio2xp_weight = frac_prio2xp_weight
-        if rel_art_xp_weight is None:
-            self.rel_art_xp_weight = d_char_v["rel_art_xp_weight"].default
-        else:
-            self.rel_art_xp_weight = rel_art_xp_weight
-        if frac_art_prio_weight is None:
-            self.frac_art_prio_weight = d_char_v["frac_art_prio_weight"].default
-        else:
-            self.frac_art_prio_weight = frac_art_prio_weight
-        if budget is None:
-            self.budget = d_char_v["budget"].default
-        else:
-            self.budget = budget
-        if softcapped_stats is None: # TODO also make sure all languages are there
-            self.softcapped_stats = copy.deepcopy(lists_and_data.SOFTCAPPED_STATS)
-        else:
-            self.softcapped_stats = softcapped_stats
-
-        for _, char in self.characters.items():
-            char.rng = self.rng
-
-    def __json__(self):
-        # Customize serialization for the Character class
-        return {
-            "version": self.version,
-            "name": self.name,
-            "save_name": self.save_name,
-            "characters": self.characters,
-            "groups": self.groups,
-            "rng": self.rng.bit_generator.state,
-            "current_year": self.current_year,
-            "frac_prio2xp_weight": self.frac_prio2xp_weight,
-            "rel_art_xp_weight": self.rel_art_xp_weight,
-            "frac_art_prio_weight": self.frac_art_prio_weight,
-            "budget": self.budget,
-            "ability_ordering": self.ability_ordering,
-            "softcapped_stats": self.softcapped_stats,
-        }
-
-    @classmethod
-    def from_json(cls, serialized_data):
-        # if needed use serialized_data["version"] to do recovery behaviour
-        chars = {}
-        for _, char in serialized_data["characters"].items():
-            chars[char["name"]] = Character.from_json(char)
-        rng = np.random.default_rng()
-        rng.bit_generator.state = serialized_data["rng"]
-        return cls(
-            name=serialized_data["name"],
-            save_name=serialized_data["save_name"],
-            characters=chars,
-            groups=serialized_data["groups"],
-            rng=rng,
-            current_year=serialized_data["current_year"],
-            frac_prio2xp_weight=serialized_data.get("frac_prio2xp_weight"),
-            rel_art_xp_weight=serialized_data.get("rel_art_xp_weight"),
-            frac_art_prio_weight=serialized_data.get("frac_art_prio_weight"),
-            budget=serialized_data.get("budget"),
-            ability_ordering=serialized_data.get("ability_ordering"),
-            softcapped_stats=serialized_data.get("softcapped_stats"),
-        )
-
-    def add_character(self,
-                      char: Character,
-                      replace: bool = False,
-                      ) -> bool:
-        if char in self.characters and not replace:
-            print("A character with this name already exists. "
-                  "Set replace to True if you want to overwrite.")
-            return False
-        self.characters[char.name] = char
-
-    def get_character(self,
-                      name: str,
-                      ) -> Character:
-        if name in self.characters:
-            return self.characters[name]
-        else:
-            return None
-
-    def add_years(self, years: int):
-        self.current_year += years
-        for char in self.characters.values():
-            char.set_to_year(self.current_year)
-
-    def set_year(self, year: int):
-        self.current_year = year
-        for char in self.characters.values():
-            char.set_to_year(year)
-
-    def characters2csv_headers(self) -> list:
-        headers = [str(self.current_year), "Age"]
-        headers += lists_and_data.CHARACTERISTICS
-        headers += lists_and_data.TECHNIQUES
-        headers += lists_and_data.FORMS
-        for _, area in self.ability_ordering.items():
-            headers += area
-        headers += list(self.groups.keys())
-        return headers
-
-    def set_xp_options(self, p2x, art_xp, f_art_prio, budget, reage=False):
-        self.frac_prio2xp_weight = p2x
-        self.rel_art_xp_weight = art_xp
-        self.frac_art_prio_weight = f_art_prio
-        self.budget = budget
-        if reage:
-            for char in self.characters.values():
-                char.frac_prio2xp_weight = p2x
-                char.rel_art_xp_weight = art_xp
-                char.frac_art_prio_weight = f_art_prio
-                char.budget = budget
-                char.reage()
-
-    def find_ordering_of_ability(self, ab_name):
-        for cat, values in self.ability_ordering.items():
-            if ab_name in values:
-                return cat
-        return "Other"
-
-    def get_all_abilities(self, dict_to_check=None):
-        if dict_to_check is None:
-            dict_to_check = self.ability_ordering
-        ret = []
-        for cat, values in dict_to_check.items():
-            ret += values
-        return ret
-
-    def sort_abilies_by_ordering(self, to_sort):
-        ret = []
-        for category in self.ability_ordering.values():
-            for name in category:
-                if name in to_sort:
-                    ret.append(name)
-        return ret
-
+import threading
+
+# .npz saves are binary and much smaller and faster for big settings
+SETTING_FILETYPES = [("JSON files", "*.json"), ("Binary settings", "*.npz")]
+
+# table of characters where only the rows that fit in the window exist as
+# Treeview items. They are refilled with the characters at the scroll
+# position, which is kept here and shown by an own scrollbar. Row texts are
+# made when first needed, for the shown rows and a buffer around them, and
+# kept until invalidated. Sorting uses typed keys from the characters
+# (numbers for ages and stat totals), also made when first needed and kept
+# like the texts, and only changes the order. Shift clicking headings sorts
+# by several columns. Pack or grid the table with its frame
 class SortableTable(ttk.Treeview):
+    buffer = 20 # rows formatted ahead above and below the shown ones
+
     def __init__(self, parent, columns, characters, *args, **kwargs):
-        ttk.Treeview.__init__(self, parent, columns=columns, *args, **kwargs)
+        self.frame = ttk.Frame(parent)
+        ttk.Treeview.__init__(self, self.frame, columns=columns, *args, **kwargs)
+        self.scrollbar = ttk.Scrollbar(self.frame,
+                                       orient="vertical",
+                                       command=self.scroll_command)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.pack(side=tk.LEFT, expand=True, fill="both")
         # self.heading("#0", text="Index")
         for col in columns:
             self.heading(col, text=col, command=lambda c=col: self.sortby(c, 0))
             self.column(col, width=100, anchor="center", stretch=True)
+        self.characters = {} # name -> character or summary
+        self.order = [] # names in the order shown
+        self.cache = {} # name -> row values
+        self.first = 0 # position in order of the top row
+        self.n_shown = 1
+        self.selected = set() # names, kept while they are scrolled away
+        self.shown = [] # row values in the items, to only set changed ones
+        self.keys = {} # name -> sort keys by column, see charsortkeys
+        self.sorting = [] # (column, descending), the first sorted by first
+        self.bind("<Configure>", self.on_resize)
+        self.bind("<<TreeviewSelect>>", self.on_select)
+        self.bind("<MouseWheel>",
+                  lambda e:self.scroll(-1 if e.delta > 0 else 1, "units"))
+        self.bind("<Button-4>", lambda e:self.scroll(-1, "units"))
+        self.bind("<Button-5>", lambda e:self.scroll(1, "units"))
+        self.bind("<Up>", lambda e:self.move_focus(-1))
+        self.bind("<Down>", lambda e:self.move_focus(1))
+        self.bind("<Prior>", lambda e:self.scroll(-1, "pages"))
+        self.bind("<Next>", lambda e:self.scroll(1, "pages"))
+        self.bind("<Shift-Button-1>", self.on_shift_click)
         self.format_and_populate(characters)
 
+    def row(self, name: str) -> tuple:
+        if name not in self.cache:
+            entry, _ = self.characters[name].name2charfield(self["columns"])
+            self.cache[name] = tuple(entry)
+        return self.cache[name]
+
+    def sortkeys(self, name: str) -> dict:
+        if name not in self.keys:
+            self.keys[name] = self.characters[name].sortkeys()
+        return self.keys[name]
+
+    def invalidate(self, names=None):
+        # forget the row texts and sort keys of names, or of all characters
+        if names is None:
+            self.cache.clear()
+            self.keys.clear()
+        else:
+            for name in names:
+                self.cache.pop(name, None)
+                self.keys.pop(name, None)
+
+    def _sort(self):
+        # stable sorts, so sorting by the least important column first
+        # leaves ties in the order of the more important ones
+        for col, descending in reversed(self.sorting):
+            self.order.sort(key=lambda name: self.sortkeys(name).get(col, ""),
+                            reverse=descending)
+
+    def _show_sorting(self):
+        for col in self["columns"]:
+            self.heading(col, text=col)
+        for i, (col, descending) in enumerate(self.sorting):
+            text = f"{col} {'▼' if descending else '▲'}"
+            if len(self.sorting) > 1:
+                text += str(i + 1)
+            self.heading(col, text=text)
+
     def sortby(self, col, descending):
-        data = [(self.set(child, col), child) for child in self.get_children('')]
-        data.sort(reverse=descending)
-        for i, item in enumerate(data):
-            self.move(item[1], '', i)
+        self.sorting = [(col, descending)]
+        self._sort()
+        self.refresh()
+        self._show_sorting()
         self.heading(col, command=lambda: self.sortby(col, int(not descending)))
 
-    def populate_table(self, data):
-        self.data = data
-        for i, item in enumerate(self.data):
-            self.insert("", "end", values=tuple(item))
-
-    def format_and_populate(self, characters: dict):
-        data = []
-        for char in characters.values():
-            entry, _ = char.name2charfield(self["columns"])
-            data.append(entry)
-        self.populate_table(data)
+    def on_shift_click(self, event):
+        # add the column to the sort, or turn its direction if already there
+        if self.identify_region(event.x, event.y) != "heading":
+            return
+        col = self["columns"][int(self.identify_column(event.x)[1:]) - 1]
+        cols = [c for c, _ in self.sorting]
+        if col in cols:
+            i = cols.index(col)
+            self.sorting[i] = (col, not self.sorting[i][1])
+        else:
+            self.sorting.append((col, False))
+        self._sort()
+        self.refresh()
+        self._show_sorting()
+        return "break"
+
+    def format_and_populate(self, characters: dict, changed=None):
+        # show characters, with the rows of the changed names (all if None)
+        # made again
+        self.characters = dict(characters) # ours, changed by apply_changes
+        self.invalidate(changed)
+        for name in [n for n in self.cache if n not in characters]:
+            del self.cache[name]
+        for name in [n for n in self.keys if n not in characters]:
+            del self.keys[name]
+        self.selected &= set(characters)
+        self.order = list(characters)
+        if self.sorting:
+            self._sort()
+        self.refresh()
+
+    def apply_changes(self, rows: dict, removed=()):
+        # show new or changed characters (name -> character or summary) and
+        # drop removed ones, keeping the order and rows of the rest. When
+        # sorted the changed are sorted in with the others, which is close to
+        # linear as the rest are already in order and their keys are kept
+        added = [name for name in rows if name not in self.characters]
+        self.invalidate(rows)
+        self.invalidate(removed)
+        self.characters.update(rows)
+        if removed:
+            removed = set(removed)
+            for name in removed:
+                self.characters.pop(name, None)
+            self.selected -= removed
+            self.order = [name for name in self.order if name not in removed]
+        self.order.extend(added)
+        if self.sorting and rows:
+            self._sort()
+        self.refresh()
+
+    def refresh(self):
+        # fill the items with the rows at the scroll position
+        total = len(self.order)
+        self.first = max(0, min(self.first, total - self.n_shown))
+        names = self.order[self.first:self.first + self.n_shown]
+        items = self.get_children("")
+        if len(items) > len(names):
+            self.delete(*items[len(names):])
+            del self.shown[len(names):]
+        for i, name in enumerate(names):
+            row = self.row(name)
+            if i >= len(items):
+                self.insert("", "end", values=row)
+                self.shown.append(row)
+            elif self.shown[i] != row:
+                self.item(items[i], values=row)
+                self.shown[i] = row
+        # ready for scrolling a bit
+        for name in self.order[max(0, self.first - self.buffer):self.first]:
+            self.row(name)
+        end = self.first + self.n_shown
+        for name in self.order[end:end + self.buffer]:
+            self.row(name)
+        items = self.get_children("")
+        self.selection_set([item for item, name in zip(items, names)
+                            if name in self.selected])
+        if total:
+            self.scrollbar.set(self.first/total, end/total)
+        else:
+            self.scrollbar.set(0, 1)
+
+    def scroll(self, number: int, what: str = "units"):
+        if what == "pages":
+            number *= max(self.n_shown - 1, 1)
+        self.first += number
+        self.refresh()
+        return "break" # the items don't scroll themselves
+
+    def scroll_command(self, command, number, what=None):
+        if command == "moveto":
+            self.first = int(float(number)*len(self.order))
+            self.refresh()
+        else:
+            self.scroll(int(number), what)
+
+    def move_focus(self, step: int):
+        items = self.get_children("")
+        if not items:
+            return "break"
+        focus = self.focus()
+        i = items.index(focus) + step if focus in items else 0
+        if i < 0 or i >= len(items):
+            self.scroll(step)
+            i = min(max(i, 0), len(items) - 1)
+        item = self.get_children("")[i]
+        self.focus(item)
+        self.selection_set(item)
+        return "break"
+
+    def on_select(self, event):
+        shown = self.order[self.first:self.first + self.n_shown]
+        chosen = {self.item(item, "values")[0] for item in self.selection()}
+        self.selected = (self.selected - set(shown)) | chosen
+
+    def on_resize(self, event):
+        style = ttk.Style()
+        row_height = int(style.lookup("Treeview", "rowheight") or 20)
+        # the heading takes about one row
+        n_shown = max(1, event.height//row_height - 1)
+        if n_shown != self.n_shown:
+            self.n_shown = n_shown
+            self.refresh()
 
 class CharInfoFrame(tk.Frame):
     def __init__(self, master, manager, *args, **kwargs):
@@ -360,6 +364,16 @@ class ArsManager:
         self.root.title("Ars Manager")
         self.setting = None # load of create setting before anything else
         self.open_chars = {}
+        # autosaves append small changes to a journal next to the save file
+        # and write the whole setting every compact_every changes and on exit
+        self.journal = None
+        self.journal_var = tk.BooleanVar(value=True)
+        self.compact_every = 100
+        # saves are written in the background, see save_setting
+        self.saver = storage.SaveWorker()
+        self.save_status_var = tk.StringVar(value="")
+        # set while run_in_background changes the setting, see setting_busy
+        self.busy = False
 
         style = ttk.Style()
         style.configure('Monospaced.TLabel', font='Courier 10') # Courier
@@ -369,8 +383,10 @@ class ArsManager:
         self.create_file_menu()
         self.create_setting_menu()
         self.enable_setting_menus(initiated=False)
+        self.create_status_bar()
         self.create_table()
         self.root.bind("<Double-1>", self.on_double_click)
+        self.root.protocol("WM_DELETE_WINDOW", self.close)
 
     def create_setting_menu(self):
         setting_menu = tk.Menu(self.menubar, tearoff=0)
@@ -386,6 +402,9 @@ class ArsManager:
                                  command=self.add_years_popup,
                                  underline=0)
         setting_menu.bind("<Alt-a>", lambda e:self.add_years_popup)
+        setting_menu.add_command(label="Memory Usage",
+                                 command=self.memory_popup,
+                                 underline=0)
 
     def create_file_menu(self):
         file_menu = tk.Menu(self.menubar, tearoff=0)
@@ -404,6 +423,12 @@ class ArsManager:
                               command=self.export_characters,
                                underline=0)
         file_menu.bind("<Alt-e>", lambda e:self.export_characters)
+        file_menu.add_command(label="Export Character History",
+                              command=self.export_history_popup,
+                               underline=17)
+        file_menu.add_command(label="Export Setting as JSON",
+                              command=self.export_setting_json,
+                               underline=15)
         file_menu.add_command(label="Load Setting",
                               command=self.load_setting,
                                underline=0)
@@ -413,8 +438,12 @@ class ArsManager:
                                underline=4)
         file_menu.bind("<Alt-c>", lambda e:self.create_character_popup)
 
+        file_menu.add_checkbutton(label="Journaled Autosave",
+                                  variable=self.journal_var,
+                                  underline=0)
+
         file_menu.add_separator()
-        file_menu.add_command(label="Exit", command=self.root.destroy)
+        file_menu.add_command(label="Exit", command=self.close)
 
     def enable_setting_menus(self, initiated: bool=True):
         if initiated:
@@ -424,9 +453,22 @@ class ArsManager:
         file_menu = self.file_menu
         file_menu.entryconfigure("Save Setting", state=state)
         file_menu.entryconfigure("Export Characters", state=state)
+        file_menu.entryconfigure("Export Character History", state=state)
+        file_menu.entryconfigure("Export Setting as JSON", state=state)
         file_menu.entryconfigure("New Character", state=state)
         self.menubar.entryconfigure("Setting", state=state)
 
+    def create_status_bar(self):
+        status = ttk.Label(self.root, textvariable=self.save_status_var,
+                           anchor=tk.W)
+        status.pack(side=tk.BOTTOM, fill=tk.X, padx=5)
+        self.update_save_status()
+
+    def update_save_status(self):
+        if self.setting is not None and self.setting.save_name:
+            self.save_status_var.set(self.saver.status)
+        self.root.after(200, self.update_save_status)
+
     def create_table(self):
         columns = ("Name",
                    "Age",
@@ -444,11 +486,11 @@ class ArsManager:
             self.tree.heading(col, text=col)
             self.tree.column(col, width=100, anchor="center")
 
-        self.tree.pack(expand=True, fill="both")
+        self.tree.frame.pack(expand=True, fill="both")
 
     def on_double_click(self, event):
         item = self.tree.identify('item',event.x,event.y)
-        if item != "": # only do the following if double clicking a char
+        if item != "" and not self.setting_busy(): # if double clicking a char
             self.make_char_popup(item)
 
     def make_char_popup(self, item):
@@ -500,8 +542,18 @@ class ArsManager:
         popup.stats_frame.grid(column=0, row=2, columnspan=3, rowspan=4, sticky=tk.NW,)
         popup.char = char
         self.update_char_popup(popup)
-        # TODO could this dict below be a memory leak/break if they are opened and then closed?
-        self.open_chars[name] = popup
+        self.open_chars.setdefault(name, []).append(popup)
+        popup.bind("<Destroy>", lambda e:self.close_char_popup(e, name, popup))
+
+    def close_char_popup(self, event, name, popup):
+        # children of the popup get the binding too, only its own counts
+        if event.widget is not popup:
+            return
+        popups = self.open_chars.get(name, [])
+        if popup in popups:
+            popups.remove(popup)
+        if not popups:
+            self.open_chars.pop(name, None)
 
     def update_char_popup(self, popup):
         popup.name_var.set(popup.char.name)
@@ -518,6 +570,8 @@ class ArsManager:
         popup.stats_frame.update_all(aged_values)
 
     def swap_char_stats_popup(self, name,):
+        if self.setting_busy():
+            return
         char = self.setting.characters[name]
         popup = tk.Toplevel(self.root)
         popup.title(f"Swap xp and prio of stats for {name}")
@@ -547,14 +601,15 @@ class ArsManager:
         cat_box = ttk.Combobox(popup, width = 27, state="disabled")
         cat_box["textvariable"] = cat_var
 
-        def reset(close=False, start=False):
+        def reset(close=False, start=False, change=None):
             ab, popup.arts = char.get_arts_and_abilities()
             popup.abilities = self.setting.sort_abilies_by_ordering(ab)
             popup.characteristics = char.characteristics
             popup.all_abilities = self.setting.get_all_abilities()
-            self.update_table()
             if not start: # if not we have made changes to character to save
-                self.save_setting()
+                self.setting.character_edited(name)
+                self.update_table()
+                self.save_setting(change)
             if close:
                 popup.destroy()
             else:
@@ -597,42 +652,34 @@ class ArsManager:
                 cat_var.set(self.setting.find_ordering_of_ability(from_var.get()))
 
         def apply(close=False):
+            if self.setting_busy():
+                return
             if type_var.get() == "":
                 # just close
                 return reset(close)
             if type_var.get() == "Characteristics":
                 swap_dict_values(char.characteristics, to_var.get(), from_var.get())
-                return reset(close)
+                return reset(close, change=self.setting.character_change(name))
             # if both exists this is easy
             if to_var.get() in char.stats:
-                swap_dict_values(char.stats, to_var.get(), from_var.get())
-                swap_dict_values(char.prios, to_var.get(), from_var.get())
-                for ystats in char.history.values():
-                    swap_dict_values(ystats, to_var.get(), from_var.get())
-                return reset(close)
+                char.swap_stats(to_var.get(), from_var.get())
+                return reset(close, change=self.setting.character_change(name))
             # handle the case where we have a new ability name
-            # at least for the character, maybe setting too
-            char.stats[to_var.get()] = char.stats.pop(from_var.get())
-            char.prios[to_var.get()] = char.prios.pop(from_var.get())
-            for ystats in char.history.values():
-                    ystats[to_var.get()] = ystats.pop(from_var.get())
+            # at least for the character, maybe setting too. This can change
+            # other characters so it is saved in full and not journaled
+            char.rename_stat(from_var.get(), to_var.get())
             # update default list of abilities in setting.ability_ordering
             # if we remove the last instance of the skill
             default = lists_and_data.DEFAULT_ABIL_ORDERING
             base_list = self.setting.get_all_abilities(default)
-            from_still_exists = from_var.get() in base_list
-            for c in self.setting.characters.values():
-                if from_var.get() in c.stats:
-                    from_still_exists = True
-                    break
+            from_still_exists = from_var.get() in base_list or \
+                self.setting.stat_in_use(from_var.get(), besides=name)
             if not from_still_exists:
                 for cat, values in self.setting.ability_ordering.items():
                     if from_var.get() in values:
                         self.setting.ability_ordering[cat].remove(from_var.get())
                 if from_var.get() in self.setting.softcapped_stats:
-                    self.setting.softcapped_stats.pop(from_var.get())
-                    for c in self.setting.characters.values():
-                        c.softcapped_stats.pop(from_var.get())
+                    self.setting.set_softcap(from_var.get(), None)
             if cat_var.get() == "":
                 return reset(close)
             # add to ordering if new skill
@@ -641,9 +688,7 @@ class ArsManager:
                 category.append(to_var.get())
                 # if marked as language, softcap to 5
                 if cat_var.get() == "Languages":
-                    self.setting.softcapped_stats[to_var.get()] = 5
-                    for c in self.setting.characters.values():
-                        c.softcapped_stats[to_var.get()] = 5
+                    self.setting.set_softcap(to_var.get(), 5)
             return reset(close)
 
         reset(start=True)
@@ -671,14 +716,62 @@ class ArsManager:
         # TODO apply/save button and make the update propagate to
         # the chars stats and history and the settings ability ordering if new
 
-    def save_setting(self):
-        if self.setting.save_name:
-                    with open(self.setting.save_name, 'w') as file:
-                        # Serialize the setting using the __json__ method
-                        serialized_setting = self.setting.__json__()
-                        json.dump(serialized_setting, file, indent=2)
+    def run_in_background(self, work, done=None):
+        # runs work in a thread and then done in the tk main loop, work must
+        # not touch any widgets. work may change the setting, so it is busy
+        # until work is done
+        self.busy = True
+        thread = threading.Thread(target=work, daemon=True)
+        thread.start()
+        def poll():
+            if thread.is_alive():
+                self.root.after(100, poll)
+                return
+            self.busy = False
+            if done is not None:
+                done()
+        poll()
+
+    def setting_busy(self) -> bool:
+        # what reads or changes the setting and isn't in the menus disabled
+        # while busy checks this first, and waits until it is done
+        if self.busy:
+            tk.messagebox.showinfo("Busy",
+                                   "The setting is being updated, try again "
+                                   "when it is done.")
+        return self.busy
+
+    # the setting is copied here and written by the save worker, so the
+    # window is not blocked and later changes don't end up in this save
+    @profiling.profiled("save_setting")
+    def save_setting(self, change: dict = None):
+        path = self.setting.save_name
+        if not path:
+            return
+        if change is not None and self.journal_var.get() and \
+           self.journal.n_records < self.compact_every:
+            with profiling.stage("journal record"):
+                line = self.journal.record(self.setting, change)
+            self.saver.journal(self.journal, line)
+            return
+        # .npz saves binary, anything else as json
+        self.saver.save(storage.SettingSnapshot(self.setting), path)
+        self.journal = storage.Journal(path)
+        self.journal.n_records = 0 # the old one is removed with the save
+
+    def close(self):
+        # compact the journal into the save file and wait for it to be
+        # written before exiting
+        if self.setting_busy(): # would save a half updated setting
+            return
+        if self.journal is not None and self.journal.n_records:
+            self.save_setting()
+        self.saver.flush()
+        self.root.destroy()
 
     def new_setting(self):
+        if self.setting_busy():
+            return
         # Create a new Toplevel window (popup)
         popup = tk.Toplevel(self.root)
         popup.geometry('250x150')
@@ -701,7 +794,7 @@ class ArsManager:
                 # Get save location
                 file_path = filedialog.asksaveasfilename(
                     defaultextension=".json",
-                    filetypes=[("JSON files", "*.json")]
+                    filetypes=SETTING_FILETYPES
                 )
 
                 # default groups
@@ -762,51 +855,125 @@ class ArsManager:
 
     def ask_save_setting(self):
         file_path = filedialog.asksaveasfilename(
-            defaultextension=".json", filetypes=[("JSON files", "*.json")]
+            defaultextension=".json", filetypes=SETTING_FILETYPES
         )
         self.setting.save_name = file_path
 
         self.save_setting()
 
+    def export_setting_json(self):
+        # json copy for interchange, keeps saving to the current file
+        file_path = filedialog.asksaveasfilename(
+            defaultextension=".json", filetypes=[("JSON files", "*.json")],
+            title="Export location"
+        )
+        if file_path:
+            storage.save_setting_json(self.setting, file_path)
+
     def load_setting(self):
+        if self.setting_busy():
+            return
         file_path = filedialog.askopenfilename(
-            defaultextension=".json", filetypes=[("JSON files", "*.json")]
+            defaultextension=".json", filetypes=SETTING_FILETYPES
         )
 
         if file_path:
-            with open(file_path, 'r') as file:
-                # Deserialize the setting using the custom from_json method
-                serialized_setting = json.load(file)
-                self.setting = Setting.from_json(serialized_setting)
-                # override to save in same file as loaded if it was renamned
-                self.setting.save_name = file_path
-                self.update_table()
-                self.enable_setting_menus()
+            self.saver.flush() # it could be a file that is being written
+            # characters are built when first used, opening only fills the
+            # table from their current stats
+            self.setting = storage.load_setting_file(file_path, lazy=True)
+            # override to save in same file as loaded if it was renamned
+            self.setting.save_name = file_path
+            self.journal = storage.Journal(file_path)
+            self.update_table()
+            self.enable_setting_menus()
 
     def update_table(self):
-        # Clear the existing items in the table
-        self.tree.delete(*self.tree.get_children())
-
-        # Populate the table with character data
-        self.tree.format_and_populate(self.setting.characters)
-        for popup in self.open_chars.values():
-            self.update_char_popup(popup)
+        # only the rows and open popups of characters changed since the last
+        # update are made again, see Setting.take_changes, and only the rows
+        # shown are made at all
+        added, modified, removed, all_changed = self.setting.take_changes()
+        if all_changed:
+            self.tree.format_and_populate(self.setting.character_rows())
+            changed = set(self.open_chars)
+        else:
+            changed = added | modified
+            self.tree.apply_changes({name: self.setting.character_row(name)
+                                     for name in changed},
+                                    removed)
+        for name, popups in list(self.open_chars.items()):
+            gone = name not in self.setting.characters
+            for popup in list(popups):
+                if gone:
+                    popup.destroy() # which takes it out of open_chars
+                elif name in changed:
+                    # a replaced character is a new object
+                    popup.char = self.setting.characters[name]
+                    self.update_char_popup(popup)
 
     def export_characters(self):
         file_path = filedialog.asksaveasfilename(defaultextension=".csv",
                                                  filetypes=[("CSV files", "*.csv")],
                                                  title="Export location")
         if file_path:
-            with open(file_path, "w", newline="") as csvfile:
-                csvwriter = csv.writer(csvfile)
-                headers = self.setting.characters2csv_headers()
-                csvwriter.writerow(headers)
-                # first field should be name, we just hijacked it for current year
-                headers[0] = "Name"
-                dictwriter = csv.DictWriter(csvfile, fieldnames=headers)
-                chars = dict(sorted(self.setting.characters.items()))
-                for char in chars.values():
-                    dictwriter.writerow(char.to_dict())
+            storage.export_characters_csv(self.setting, file_path)
+
+    def export_history_popup(self):
+        popup = tk.Toplevel(self.root)
+        popup.title("Export character history")
+
+        years_label = ttk.Label(popup, text="Years from and to, empty for all")
+        years_label.grid(column=0, row=0, sticky=tk.NW, padx=10, pady=10)
+        first_entry = ttk.Entry(popup, width=10)
+        first_entry.grid(column=1, row=0, sticky=tk.NW, padx=10, pady=10)
+        last_entry = ttk.Entry(popup, width=10)
+        last_entry.insert(0, str(self.setting.current_year))
+        last_entry.grid(column=2, row=0, sticky=tk.NW, padx=10, pady=10)
+
+        # empty means any group of the category
+        group_vars = {}
+        for row, (category, groups) in enumerate(self.setting.groups.items()):
+            label = ttk.Label(popup, text=category)
+            label.grid(column=0, row=row+1, sticky=tk.NW, padx=10)
+            group_vars[category] = tk.StringVar()
+            box = ttk.Combobox(popup,
+                               width=27,
+                               state="readonly",
+                               textvariable=group_vars[category])
+            box["values"] = [""] + sorted(g for g in groups if g)
+            box.grid(column=1, row=row+1, columnspan=2, sticky=tk.NW, padx=10)
+
+        wide_var = tk.BooleanVar(value=False)
+        wide_check = ttk.Checkbutton(popup,
+                                     text="One row per character and year",
+                                     variable=wide_var)
+        wide_check.grid(column=0, row=len(group_vars)+1, columnspan=3,
+                        sticky=tk.NW, padx=10, pady=10)
+
+        def export():
+            first, last = first_entry.get().strip(), last_entry.get().strip()
+            if not all(year == "" or year.lstrip("-").isdigit()
+                       for year in (first, last)):
+                return
+            file_path = filedialog.asksaveasfilename(
+                defaultextension=".csv", filetypes=[("CSV files", "*.csv")],
+                title="Export location", parent=popup)
+            if not file_path:
+                return
+            groups = {category: var.get()
+                      for category, var in group_vars.items() if var.get()}
+            storage.export_history_csv(self.setting,
+                                       file_path,
+                                       first=int(first) if first else None,
+                                       last=int(last) if last else None,
+                                       groups=groups,
+                                       wide=wide_var.get())
+            popup.destroy()
+
+        export_b = ttk.Button(popup, text="Export", command=export)
+        export_b.grid(column=0, row=len(group_vars)+2, padx=10, pady=10,
+                      sticky=tk.NW)
+        popup.bind('<Return>', lambda e:export())
 
     def set_year_popup(self):
         popup = tk.Toplevel(self.root)
@@ -838,7 +1005,7 @@ class ArsManager:
                 return
             self.setting.set_year(year)
             self.update_table()
-            self.save_setting()
+            self.save_setting(self.setting.year_change())
             popup.destroy()
 
         add_b = ttk.Button(popup,text="Set year",
@@ -871,7 +1038,7 @@ class ArsManager:
                 return
             self.setting.add_years(years)
             self.update_table()
-            self.save_setting()
+            self.save_setting(self.setting.year_change())
             popup.destroy()
 
         add_b = ttk.Button(popup,text="Add years",
@@ -883,6 +1050,17 @@ class ArsManager:
         # Run the Tkinter main loop for the popup window
         popup.mainloop()
 
+    def memory_popup(self):
+        popup = tk.Toplevel(self.root)
+        popup.title("Memory usage")
+        report = ttk.Label(popup,
+                           text=self.setting.memory_report(),
+                           style="Monospaced.TLabel",
+                           justify=tk.LEFT)
+        report.grid(column=0, row=0, sticky=tk.NW, padx=10, pady=10)
+        close_b = ttk.Button(popup, text="Close", command=popup.destroy)
+        close_b.grid(column=0, row=1, padx=10, pady=10, sticky=tk.NW)
+
     def create_character_popup(self):
         ccvals = {}
         ccvals["values"] = cg.gen_mage_values()
@@ -929,13 +1107,32 @@ class ArsManager:
             def set_and_reage():
                 set_xp_options(reage=True)
             def set_xp_options(reage = False):
-                self.setting.set_xp_options(p2x=frac_prio2xp_weight_var.get(),
-                                            art_xp=rel_art_xp_weight_var.get(),
-                                            f_art_prio=frac_art_prio_weight_var.get(),
-                                            budget=budget_var.get(),
-                                            reage=reage)
+                if self.setting_busy():
+                    return
+                options = {"p2x": frac_prio2xp_weight_var.get(),
+                           "art_xp": rel_art_xp_weight_var.get(),
+                           "f_art_prio": frac_art_prio_weight_var.get(),
+                           "budget": budget_var.get()}
+                from_year = reage_year_var.get().strip()
+                from_year = int(from_year) if from_year else None
                 popup2.destroy()
-                self.update_table()
+                if not reage:
+                    self.setting.set_xp_options(**options)
+                    self.update_table()
+                    return
+                # reaging a big setting takes a while, so do it in the
+                # background. The setting menus are disabled and everything
+                # else using the setting checks setting_busy until it is done
+                def done():
+                    self.enable_setting_menus()
+                    self.update_table()
+                    self.save_setting()
+                self.enable_setting_menus(initiated=False)
+                self.run_in_background(
+                    lambda: self.setting.set_xp_options(reage=True,
+                                                        from_year=from_year,
+                                                        **options),
+                    done)
 
             popup2.title("Set xp options for this character")
 
@@ -995,17 +1192,30 @@ class ArsManager:
                                 padx=10,
                                 pady=10)
 
+            reage_year_text = "Year to re-age from, earlier years are kept. "
+            reage_year_text += "Empty to re-age from gauntlet."
+            reage_year_label = ttk.Label(popup2,
+                              text=reage_year_text)
+            reage_year_label.grid(column=0, row=4, sticky=tk.NW, padx=10, pady=10)
+            reage_year_var = tk.StringVar(value="")
+            reage_year_entry = ttk.Entry(popup2, textvariable = reage_year_var)
+            reage_year_entry.grid(column=1,
+                                row=4,
+                                sticky=tk.NW,
+                                padx=10,
+                                pady=10)
+
             b_text = "Set for all current and future characters"
             b_text += "and re-age all characters"
             ra_b = ttk.Button(popup2,text=b_text,
                            command=lambda:set_and_reage())
-            ra_b.grid(column=0, row=4, padx=10, pady=10, sticky=tk.NW, columnspan=2)
+            ra_b.grid(column=0, row=5, padx=10, pady=10, sticky=tk.NW, columnspan=2)
             set_b = ttk.Button(popup2,text="Set for this and future characters",
                            command=lambda:set_xp_options())
-            set_b.grid(column=1, row=4, padx=10, pady=10, sticky=tk.NW, columnspan=2)
+            set_b.grid(column=1, row=5, padx=10, pady=10, sticky=tk.NW, columnspan=2)
             close_b = ttk.Button(popup2,text="Set for this character",
                            command=lambda:popup2.destroy())
-            close_b.grid(column=3, row=4, padx=10, pady=10, sticky=tk.NW, columnspan=2)
+            close_b.grid(column=3, row=5, padx=10, pady=10, sticky=tk.NW, columnspan=2)
             popup2.bind('<Return>', lambda e:popup2.destroy())
             # TODO for now these values actually change immediately
             # not when pushing button...
@@ -1163,6 +1373,8 @@ class ArsManager:
         popup.bind('<Alt-f>', lambda e:gen_forms)
 
         def save_and_close_popup(self, name):
+            if self.setting_busy():
+                return
             if not name or name in self.setting.characters:
                 tk.messagebox.showwarning("Warning",
                                           "Please enter a unique character name.")
@@ -1173,17 +1385,13 @@ class ArsManager:
                       "Covenant": covenant.get(),
                       "Tribunal": tribunal.get()}
             # add groups to setting if not already there
-            for category, group in groups.items():
-                if category not in self.setting.groups:
-                    self.setting.groups[category] = {group: None}
-                if group not in self.setting.groups[category]:
-                    self.setting.groups[category][group] = None
+            self.setting.add_groups(groups)
             ccvals["new_char"].name = name
             ccvals["new_char"].groups = groups
             self.setting.add_character(ccvals["new_char"])
             self.update_table()
             # we autosave after each character has been created
-            self.save_setting()
+            self.save_setting(self.setting.character_change(name, new=True))
                 # Close the popup
             popup.destroy()
 
@@ -0,0 +1,298 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+import numpy as np
+import char_generator as cg
+import storage
+from character import Character, stream_key
+from setting import Setting
+
+# benchmarks of generation, aging, serialization and export on synthetic
+# settings made from fixed seeds, run as
+#   python benchmark.py --sizes 10 1000 50000 --out results.json
+# Every result has the time of each repeat in seconds, for one call of what
+# is measured, and all of them go to a json file together with what they
+# were run on so runs can be compared over time. With --baseline the suite
+# is run --runs times and the hot paths are compared with the baseline file,
+# exiting with 1 if any got slower by more than --threshold. Baselines are
+# best recorded with --runs above 1 too, timings differ between processes
+SEED = 1220
+SIZES = [10, 1000, 50000]
+YEAR = 1220
+RESULTS_DIR = "user_data"
+# checked against the baseline unless others are given with --gate
+HOT_PATHS = ["Character._step_stats",
+             "Character.set_to_year 100 years",
+             "Setting.add_years 10 years",
+             "save json",
+             "load json",
+             "save npz",
+             "load npz"]
+
+def timed(func, repeat: int) -> list:
+    func() # warm up caches and lazy imports, not timed
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+def make_setting(n: int, seed: int = SEED) -> Setting:
+    # n mages aged 25 to 100 in YEAR, spread over a few groups
+    setting = Setting(f"bench {n}", None, characters={}, groups={},
+                      current_year=YEAR, seed=seed)
+    rng = np.random.default_rng(seed)
+    ages = rng.integers(25, 100, endpoint=True, size=n).tolist()
+    per_mage = [{"char_input_year": YEAR - age + 25,
+                 "current_year": YEAR - age + 25,
+                 "groups": {"House": f"House {i % 12}",
+                            "Covenant": f"Covenant {i % 97}",
+                            "Tribunal": f"Tribunal {i % 13}"}}
+                for i, age in enumerate(ages)]
+    mages = cg.create_mages([f"Magus {i}" for i in range(n)],
+                            seed=seed,
+                            per_mage=per_mage)
+    for mage in mages:
+        setting.add_groups(mage.groups)
+        setting.add_character(mage)
+    setting.set_year(YEAR)
+    return setting
+
+def make_mage(seed: int = SEED) -> Character:
+    cg.rng = np.random.default_rng(seed)
+    mage = cg.create_mage_from_gen_vals("Bench", cg.gen_mage_values(),
+                                        char_input_year=YEAR,
+                                        groups={})
+    mage.rng = np.random.default_rng(seed)
+    return mage
+
+# benchmarks that don't depend on the setting size, (name, calls, func)
+def single_benchmarks() -> list:
+    cg.rng = np.random.default_rng(SEED)
+    mage = make_mage()
+    stats = mage.stats
+    budget = mage._get_budget_at_year(YEAR + 1)
+    key = stream_key(mage.rng.bit_generator.state)
+    words = mage._year_words(key, YEAR + 1, YEAR + 1)[0]
+
+    def gen_values():
+        for _ in range(100):
+            cg.gen_mage_values()
+
+    def step_stats():
+        for _ in range(100):
+            mage._step_stats(stats, budget, words)
+
+    def set_to_year():
+        mage.reage(age=False)
+        mage.set_to_year(YEAR + 100)
+
+    return [("gen_mage_values", 100, gen_values),
+            ("Character._step_stats", 100, step_stats),
+            ("Character.set_to_year 100 years", 1, set_to_year)]
+
+# benchmarks run on a setting of each size, (name, func)
+def setting_benchmarks(setting: Setting, tmp_dir: str) -> list:
+    chars = list(setting.characters.values())
+
+    def add_years():
+        for char in chars:
+            char.reage(from_year=YEAR, age=False)
+        setting.set_year(YEAR)
+        setting.add_years(10)
+
+    def to_json():
+        return [json.dumps(char) for char in chars]
+
+    serialized = to_json()
+
+    def from_json():
+        for data in serialized:
+            Character.from_json(json.loads(data))
+
+    def save(path: str):
+        return lambda: storage.save_setting_file(setting, path)
+
+    def load(path: str):
+        return lambda: storage.load_setting_file(path)
+
+    json_path = os.path.join(tmp_dir, "bench.json")
+    npz_path = os.path.join(tmp_dir, "bench.npz")
+    csv_path = os.path.join(tmp_dir, "bench.csv")
+    return [("Setting.add_years 10 years", add_years),
+            ("Character.__json__", to_json),
+            ("Character.from_json", from_json),
+            ("save json", save(json_path)),
+            ("load json", load(json_path)),
+            ("save npz", save(npz_path)),
+            ("load npz", load(npz_path)),
+            ("export csv",
+             lambda: storage.export_characters_csv(setting, csv_path))]
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"],
+                                capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))
+                                ).stdout.strip()
+    except OSError:
+        commit = ""
+    return {"date": datetime.now().isoformat(timespec="seconds"),
+            "commit": commit,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpus": os.cpu_count()}
+
+def result(name: str, size, calls: int, times: list) -> dict:
+    times = [t / calls for t in times]
+    return {"name": name,
+            "size": size,
+            "calls": calls,
+            "repeat": len(times),
+            "best": min(times),
+            "mean": sum(times) / len(times),
+            "times": times}
+
+def run(sizes: list, repeat: int, log=print) -> dict:
+    results = []
+    for name, calls, func in single_benchmarks():
+        results.append(result(name, None, calls, timed(func, repeat)))
+        log(f"{name:36} {results[-1]['best']:.6f} s")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size in sizes:
+            start = time.perf_counter()
+            setting = make_setting(size)
+            results.append(result("make setting", size, 1,
+                                  [time.perf_counter() - start]))
+            log(f"{'make setting':36} {size:>6} {results[-1]['best']:.6f} s")
+            # big settings are only timed once, they take long enough
+            n = repeat if size <= 1000 else 1
+            for name, func in setting_benchmarks(setting, tmp_dir):
+                results.append(result(name, size, 1, timed(func, n)))
+                log(f"{name:36} {size:>6} {results[-1]['best']:.6f} s")
+    return {"environment": environment(), "results": results}
+
+# (name, size) -> every time measured for it in the reports
+def collect(reports: list) -> dict:
+    times = {}
+    for report in reports:
+        for res in report["results"]:
+            key = (res["name"], res["size"])
+            times.setdefault(key, []).extend(res.get("times", [res["best"]]))
+    return times
+
+def band(times: list) -> tuple[float, float]:
+    # median and noise, the median absolute deviation scaled to match the
+    # standard deviation of normally distributed times
+    times = np.asarray(times)
+    median = np.median(times)
+    return float(median), float(1.4826 * np.median(np.abs(times - median)))
+
+# a hot path regressed if its median is more than threshold slower than the
+# baseline median, and also further away than the noise of both allows. One
+# in the baseline that wasn't measured now, at a size that was, fails too,
+# with None for now and the change
+def compare(baseline: dict,
+            current: dict,
+            threshold: float,
+            gate: list,
+            ) -> list:
+    rows = []
+    for key, times in current.items():
+        if key not in baseline or key[0] not in gate:
+            continue
+        base, base_noise = band(baseline[key])
+        now, noise = band(times)
+        change = now / base - 1
+        regressed = change > threshold and \
+                    now - base > 2 * (base_noise + noise)
+        rows.append((key[0], key[1], base, now, change, regressed))
+    sizes = {size for _, size in current}
+    for key, times in baseline.items():
+        if key[0] in gate and key[1] in sizes and key not in current:
+            rows.append((key[0], key[1], band(times)[0], None, None, True))
+    return rows
+
+def gate_against(baseline_path: str,
+                 sizes: list,
+                 repeat: int,
+                 runs: int,
+                 threshold: float,
+                 gate: list,
+                 ) -> tuple[dict, bool]:
+    with open(baseline_path, "r") as file:
+        baseline = json.load(file)
+    if sizes is None: # the ones in the baseline
+        sizes = sorted({res["size"] for res in baseline["results"]
+                        if res["size"] is not None})
+    reports = []
+    for i in range(runs):
+        print(f"Run {i + 1} of {runs}")
+        reports.append(run(sizes, repeat, log=lambda *_: None))
+    rows = compare(collect([baseline]), collect(reports), threshold, gate)
+    failed = False
+    print(f"{'':36} {'size':>6} {'baseline':>10} {'now':>10} {'change':>8}")
+    for name, size, base, now, change, regressed in rows:
+        failed |= regressed
+        if now is None:
+            print(f"{name:36} {size or '':>6} {base:10.6f} {'':>10} "
+                  f"{'':>8}  MISSING")
+            continue
+        mark = "  SLOWER" if regressed else ""
+        print(f"{name:36} {size or '':>6} {base:10.6f} {now:10.6f} "
+              f"{change:+8.1%}{mark}")
+    report = {"environment": environment(),
+              "baseline": baseline_path,
+              "results": [res for report in reports
+                          for res in report["results"]]}
+    return report, failed
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Ars Manager benchmarks")
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        help="number of characters of the settings, default "
+                             f"{SIZES} or the ones in the baseline")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--out", help="result file, default a new file "
+                                      f"in {RESULTS_DIR}/")
+    parser.add_argument("--baseline",
+                        help="result file to compare the hot paths with")
+    parser.add_argument("--runs", type=int, default=None,
+                        help="times the suite is run, default 1 or 3 when "
+                             "comparing with a baseline")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="slowdown allowed, 0.1 is 10%%")
+    parser.add_argument("--gate", nargs="+", default=HOT_PATHS,
+                        help="benchmarks compared with the baseline")
+    args = parser.parse_args(argv)
+    out = args.out
+    if out is None:
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        out = os.path.join(RESULTS_DIR, f"benchmark-{stamp}.json")
+    failed = False
+    if args.baseline:
+        report, failed = gate_against(args.baseline, args.sizes, args.repeat,
+                                      args.runs or 3, args.threshold,
+                                      args.gate)
+    else:
+        reports = [run(args.sizes or SIZES, args.repeat)
+                   for _ in range(args.runs or 1)]
+        report = {"environment": reports[0]["environment"],
+                  "results": [res for report in reports
+                              for res in report["results"]]}
+    with open(out, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"Results written to {out}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
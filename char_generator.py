@@ -1,8 +1,11 @@
 import numpy as np
-from character import Character, Ability, Art
+from character import Character, Ability, Art, WeightedSampler
 from collections import defaultdict
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
 from  lists_and_data import *
 import copy
+import profiling
 
 # initiate default rng
 rng = np.random.default_rng()
@@ -31,6 +34,16 @@ def abil_order_split(abil_dict: dict,
         print("There are abilities that where not found, they are not displayed!")
     return ret
 
+# samplers for the fixed prio tables in lists_and_data, built once per table
+@lru_cache(maxsize=None)
+def _fixed_sampler(prio: tuple) -> WeightedSampler:
+    return WeightedSampler(prio)
+
+def _select_by_prio(prio_dict: dict):
+    names = list(prio_dict.keys())
+    sampler = _fixed_sampler(tuple(prio_dict.values()))
+    return names[sampler.draw(rng)]
+
 def sort_by_name_list(names, dct):
     assert len(names) == len(dct)
     assert all(name in names for name in dct.keys())
@@ -57,17 +70,9 @@ def get_template(name: str) -> tuple[list, list, list]:
 # designed for mages, at least change prio for other characters
 def get_characteristics_from_array(balance: str = None, ic: int = None):
     if balance is None:
-        names = list(CHAR_ARRAYS_PRIO.keys())
-        prio = list(CHAR_ARRAYS_PRIO.values())
-        balance = str(rng.choice(names,
-                             1,
-                             p=np.array(prio)/sum(prio))[0])
+        balance = str(_select_by_prio(CHAR_ARRAYS_PRIO))
     if ic is None:
-        names = list(IC_PRIO.keys())
-        prio = list(IC_PRIO.values())
-        ic = int(rng.choice(names,
-                        1,
-                        p=np.array(prio)/sum(prio))[0])
+        ic = int(_select_by_prio(IC_PRIO))
     names = CHARACTERISTICS
     return assign_array(names,
                         CHAR_ARRAYS[balance][ic],
@@ -247,10 +252,7 @@ def assign_array(names: list,
     if prio == None:
         prio = [1]*len(names)
     array = copy.deepcopy(array)
-    nms = rng.choice(names,
-                     len(names),
-                     replace=False,
-                     p=np.array(prio)/sum(prio))
+    nms = [names[i] for i in WeightedSampler(prio).order(rng)]
     return sort_by_name_list(names,
                              {name: tpe(val) for name, val in zip(nms, array)})
 
@@ -267,12 +269,8 @@ def _assign_array_with_min_req(names: list,
     # sort req by value
     array = copy.deepcopy(array)
     req = list(sorted(req.items(), key=lambda x:x[1], reverse=True))
-    nms = rng.choice(names,
-                     len(names),
-                     replace=False,
-                     p=np.array(prio)/sum(prio))
+    nms = [names[i] for i in WeightedSampler(prio).order(rng)]
     ret_dict = {}
-    nms = list(nms)
     while(len(array)>0):
         if not array:
             break
@@ -300,21 +298,18 @@ def select_arrays() -> tuple[list, list, list]:
     return ab_array, te_array, fo_array
 
 def select_array(array, prio_dict) -> list:
-    names = list(array.keys())
-    prio = []
-    for name in names:
-        prio.append(prio_dict[name])
-    setting = rng.choice(names,
-                            1,
-                            replace=False,
-                            p=np.array(prio)/sum(prio))
-    return copy.deepcopy(array[setting[0]])
+    setting = _select_by_prio({name: prio_dict[name] for name in array})
+    return copy.deepcopy(array[setting])
 
+@profiling.profiled("gen_mage_values")
 def gen_mage_values() -> dict:
-    characteristics = get_characteristics_from_array()
-    abilities, ab_prios, area_prios = get_abilities_from_array()
-    techniques, te_prios = get_techniques_from_array()
-    forms, fo_prios = get_forms_from_array()
+    with profiling.stage("characteristics"):
+        characteristics = get_characteristics_from_array()
+    with profiling.stage("abilities"):
+        abilities, ab_prios, area_prios = get_abilities_from_array()
+    with profiling.stage("arts"):
+        techniques, te_prios = get_techniques_from_array()
+        forms, fo_prios = get_forms_from_array()
     ret = {"characteristics": characteristics,
            "abilities": abilities,
            "techniques": techniques,
@@ -347,6 +342,40 @@ def create_mage_from_gen_vals(name: str,
                     **kwargs,
                     )
 
+# one mage from gen_mage_values with the module rng seeded by seed, so the
+# result only depends on the seed and not on which process makes it
+def _create_mage_seeded(name: str,
+                        seed: np.random.SeedSequence,
+                        kwargs: dict,
+                        ) -> Character:
+    global rng
+    old_rng = rng
+    rng = np.random.default_rng(seed)
+    try:
+        return create_mage_from_gen_vals(name, gen_mage_values(), **kwargs)
+    finally:
+        rng = old_rng
+
+# makes a mage for each name, the same ones for a seed whatever the number of
+# workers. kwargs go to create_mage_from_gen_vals for every mage, per_mage
+# (if given) is a list with extra kwargs for each one
+def create_mages(names: list,
+                 seed: int = None,
+                 workers: int = 1,
+                 per_mage: list = None,
+                 **kwargs,
+                 ) -> list:
+    seeds = np.random.SeedSequence(seed).spawn(len(names))
+    if per_mage is None:
+        per_mage = [{}] * len(names)
+    args = [kwargs | extra for extra in per_mage]
+    if workers == 1:
+        return list(map(_create_mage_seeded, names, seeds, args))
+    chunksize = max(1, len(names)//(4*workers))
+    with ProcessPoolExecutor(workers) as pool:
+        return list(pool.map(_create_mage_seeded, names, seeds, args,
+                             chunksize=chunksize))
+
 # generates standard age 25, just out of gauntlet mages from mostly fixed arrays
 # of stats
 def gen_from_stats_array(template: str,
@@ -1,8 +1,15 @@
 import numpy as np
+import math
 import copy
+import bisect
+from collections import OrderedDict
 import itertools
 import json
+import hashlib
 import importlib
+import sys
+import profiling
+from contextlib import contextmanager
 
 def dict2string(dct, sort=True, lb=False) -> str:
     if sort:
@@ -15,6 +22,57 @@ def dict2string(dct, sort=True, lb=False) -> str:
             s += f"{key}: {val} "
     return s
 
+# largest v with v*(v+1)/2 <= t, exact for any non-negative integer t
+def triangular_root(t: int) -> int:
+    return (math.isqrt(8*t + 1) - 1)//2
+
+# same as triangular_root for a whole int array of any shape, float sqrt
+# followed by an exact integer correction of the rounding
+def triangular_root_array(t: np.ndarray) -> np.ndarray:
+    t = np.asarray(t, dtype=np.int64)
+    v = ((np.sqrt(8*t.astype(np.float64) + 1) - 1)//2).astype(np.int64)
+    v -= v*(v+1)//2 > t
+    v += (v+1)*(v+2)//2 <= t
+    return v
+
+# deep size in bytes of obj, following containers, object attributes and
+# numpy buffers. Objects with their id in seen are not counted, and the ones
+# counted are added to it, so sharing a seen set counts shared objects once
+def sizeof(obj, seen: set = None) -> int:
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, np.ndarray):
+        # views don't include the buffer they look into, count what they see
+        # of it. Loaded histories are views into arrays shared by characters
+        if obj.base is not None:
+            size += obj.nbytes
+        return size
+    if isinstance(obj, (str, bytes, int, float, bool)) or obj is None:
+        return size
+    if isinstance(obj, dict):
+        size += sum(sizeof(key, seen) + sizeof(val, seen)
+                    for key, val in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(sizeof(item, seen) for item in obj)
+    if hasattr(obj, "__dict__"):
+        size += sizeof(vars(obj), seen)
+    for cls in type(obj).__mro__:
+        for name in getattr(cls, "__slots__", ()):
+            if hasattr(obj, name):
+                size += sizeof(getattr(obj, name), seen)
+    return size
+
+def format_bytes(n: int) -> str:
+    for unit in ["B", "kB", "MB"]:
+        if abs(n) < 1024:
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} GB"
+
 # only tracks values of the ability, assume that the name will be tracked when
 # it is stored in a stats dict
 class Ability:
@@ -46,12 +104,22 @@ class Ability:
 
     @staticmethod
     def xp2val(xp: int) -> tuple[int, int]:
-        val = int(-1/2 + np.sqrt(1/4 + 2*xp/5))
+        xp = int(xp)
+        val = triangular_root(xp//5)
         return val, xp-Ability.val2xp(val)
 
     @staticmethod
     def val2xp(val: int) -> int:
-        return 5*(1+val)*val/2
+        return 5*(1+val)*val//2
+
+    @staticmethod
+    def xp2val_array(xp: np.ndarray) -> np.ndarray:
+        return triangular_root_array(np.asarray(xp)//5)
+
+    @staticmethod
+    def val2xp_array(val: np.ndarray) -> np.ndarray:
+        val = np.asarray(val, dtype=np.int64)
+        return 5*(1+val)*val//2
 
     def add_xp(self, xp: int) -> None:
         assert xp >= 0
@@ -98,12 +166,22 @@ class Art(Ability):
 
     @staticmethod
     def xp2val(xp) -> tuple[int, int]:
-        val = int(-1/2 + np.sqrt(1/4 + 2*xp))
+        xp = int(xp)
+        val = triangular_root(xp)
         return val, xp-Art.val2xp(val)
 
     @staticmethod
     def val2xp(val) -> int:
-        return (1+val)*val/2
+        return (1+val)*val//2
+
+    @staticmethod
+    def xp2val_array(xp: np.ndarray) -> np.ndarray:
+        return triangular_root_array(xp)
+
+    @staticmethod
+    def val2xp_array(val: np.ndarray) -> np.ndarray:
+        val = np.asarray(val, dtype=np.int64)
+        return (1+val)*val//2
 
     def set_val(self, value: int, xp: int = 0) -> None:
         assert value >= 0
@@ -112,7 +190,513 @@ class Art(Ability):
         self._value = value
         self._tot_xp = self.val2xp(value) + xp
 
+# weighted sampler that builds the cdf of the weights once, for drawing many
+# times from the same weights without rng.choice checking and normalising the
+# probabilities on every call
+class WeightedSampler:
+    def __init__(self, weights) -> None:
+        self.cdf = np.cumsum(np.asarray(weights, dtype=np.float64))
+        assert len(self.cdf) > 0 and self.cdf[-1] > 0
+
+    def __len__(self) -> int:
+        return len(self.cdf)
+
+    def draw(self, rng: np.random.Generator, size=None):
+        # indices drawn with replacement, like rng.choice(n, size, p=p)
+        u = rng.random(size)*self.cdf[-1]
+        return np.minimum(np.searchsorted(self.cdf, u, side="right"),
+                          len(self.cdf) - 1)
+
+    def order(self, rng: np.random.Generator) -> np.ndarray:
+        # all indices in weighted random order, distributed like
+        # rng.choice(n, n, replace=False, p=p). Exponential race, the index
+        # with the smallest exp/weight comes first
+        weights = np.diff(self.cdf, prepend=0)
+        with np.errstate(divide="ignore"):
+            keys = rng.exponential(size=len(weights))/weights
+        return np.argsort(keys, kind="stable")
+
+# values of a stat xp array or matrix of any shape, art is a bool mask over
+# the last axis (the stat columns) telling which columns are arts
+def xp2val_array(xp: np.ndarray, art: np.ndarray) -> np.ndarray:
+    xp = np.asarray(xp, dtype=np.int64)
+    # arts use xp as is, abilities need 5 times as much for the same value
+    return triangular_root_array(np.where(art, xp, xp//5))
+
+def val2xp_array(val: np.ndarray, art: np.ndarray) -> np.ndarray:
+    return np.where(art, Art.val2xp_array(val), Ability.val2xp_array(val))
+
+# name -> column lookup shared by all StatBlocks of a character, so renaming
+# or swapping a stat here changes it in every year of the history at once
+class StatIndex:
+    def __init__(self,
+                 names: list,
+                 art: list,
+                 ) -> None:
+        assert len(names) == len(art)
+        self.names = list(names)
+        self.cols = {name: i for i, name in enumerate(self.names)}
+        self.art = np.array(art, dtype=bool)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def swap(self, a: str, b: str) -> None:
+        ca, cb = self.cols[a], self.cols[b]
+        self.cols[a], self.cols[b] = cb, ca
+        self.names[ca], self.names[cb] = b, a
+
+    def rename(self, old: str, new: str) -> None:
+        assert new not in self.cols
+        col = self.cols.pop(old)
+        self.cols[new] = col
+        self.names[col] = new
+
+# total xp of all stats of a character for one year in a single int array,
+# indexing by name gives an Ability or Art built from the xp. These are copies,
+# so change xp through the block (add_xp, __setitem__) and not through them
+class StatBlock:
+    __slots__ = ("index", "xp")
+
+    def __init__(self,
+                 index: StatIndex,
+                 xp: np.ndarray = None,
+                 ) -> None:
+        self.index = index
+        if xp is None:
+            xp = np.zeros(len(index), dtype=np.int32)
+        assert len(xp) == len(index)
+        self.xp = xp
+
+    @classmethod
+    def from_dict(cls, stats: dict, index: StatIndex = None):
+        if index is None:
+            index = StatIndex(list(stats.keys()),
+                              [isinstance(s, Art) for s in stats.values()])
+        assert len(stats) == len(index)
+        block = cls(index)
+        for name, stat in stats.items():
+            block.xp[index.cols[name]] = int(stat.tot_xp)
+        return block
+
+    @classmethod
+    def from_xp(cls, xp: dict, index: StatIndex):
+        # from name -> total xp, like in saved history
+        assert len(xp) == len(index)
+        return cls(index, np.array([xp[name] for name in index.names],
+                                   dtype=np.int32))
+
+    def copy(self):
+        return StatBlock(self.index, self.xp.copy())
+
+    def __deepcopy__(self, memo):
+        # keep the index shared, it is what ties the years together
+        return self.copy()
+
+    def _view(self, col: int) -> Ability:
+        tpe = Art if self.index.art[col] else Ability
+        return tpe(xp=int(self.xp[col]), tot_xp=True)
+
+    def __getitem__(self, name: str) -> Ability:
+        return self._view(self.index.cols[name])
+
+    def __setitem__(self, name: str, stat: Ability) -> None:
+        # only existing stats, add new ones through the index
+        self.xp[self.index.cols[name]] = int(stat.tot_xp)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.index.cols
+
+    def __iter__(self):
+        return iter(self.index.cols)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def keys(self):
+        return self.index.cols.keys()
+
+    def values(self):
+        return [self._view(col) for col in self.index.cols.values()]
+
+    def items(self):
+        return [(name, self._view(col)) for name, col in self.index.cols.items()]
+
+    def add_xp(self, name: str, xp: int) -> None:
+        assert xp >= 0
+        self.xp[self.index.cols[name]] += xp
+
+    def values_array(self) -> np.ndarray:
+        return xp2val_array(self.xp, self.index.art)
+
+    def value_dict(self, art: bool = None) -> dict:
+        # name -> value, only arts or only abilities if art is given
+        vals = self.values_array().tolist()
+        is_art = self.index.art.tolist()
+        ret = {}
+        for name, col in self.index.cols.items():
+            if art is None or is_art[col] == art:
+                ret[name] = vals[col]
+        return ret
+
+    def xp_dict(self, art: bool = None) -> dict:
+        # name -> total xp, only arts or only abilities if art is given
+        xp = self.xp.tolist()
+        is_art = self.index.art.tolist()
+        ret = {}
+        for name, col in self.index.cols.items():
+            if art is None or is_art[col] == art:
+                ret[name] = xp[col]
+        return ret
+
+# all years of a characters stats as rows of one (years x stats) xp matrix,
+# starting at first_year. Rows are only appended, so the matrix grows by
+# doubling its capacity when full
+class StatHistory:
+    replays = False # years are stored, not regenerated from rng states
+
+    def __init__(self,
+                 first_year: int,
+                 first: StatBlock,
+                 capacity: int = 16,
+                 ) -> None:
+        self.index = first.index
+        self.first_year = first_year
+        self._xp = np.zeros((max(capacity, 1), len(self.index)), dtype=np.int32)
+        self._xp[0] = first.xp
+        self._n = 1
+
+    @property
+    def last_year(self) -> int:
+        return self.first_year + self._n - 1
+
+    @property
+    def matrix(self) -> np.ndarray:
+        return self._xp[:self._n]
+
+    @property
+    def capacity(self) -> int:
+        # years that fit before the matrix has to grow
+        return len(self._xp)
+
+    def years(self) -> np.ndarray:
+        return np.arange(self.first_year, self.last_year + 1)
+
+    def _row(self, year: int) -> int:
+        if year < self.first_year or year > self.last_year:
+            raise KeyError(year)
+        return year - self.first_year
+
+    def __contains__(self, year: int) -> bool:
+        return self.first_year <= year <= self.last_year
+
+    def __len__(self) -> int:
+        return self._n
+
+    def __iter__(self):
+        return iter(range(self.first_year, self.last_year + 1))
+
+    def keys(self):
+        return range(self.first_year, self.last_year + 1)
+
+    def __getitem__(self, year: int) -> StatBlock:
+        # view of the row, copy it before changing it
+        return StatBlock(self.index, self._xp[self._row(year)])
+
+    def __setitem__(self, year: int, stats: StatBlock) -> None:
+        assert stats.index is self.index
+        if year == self.last_year + 1:
+            self.append(stats.xp)
+        else:
+            self._xp[self._row(year)] = stats.xp
+
+    def values(self):
+        return [self[year] for year in self]
+
+    def items(self):
+        return [(year, self[year]) for year in self]
+
+    def append(self, xp: np.ndarray) -> None:
+        self.extend(xp[None, :])
+
+    def extend(self, xp: np.ndarray) -> None:
+        # add several following years at once, one row per year
+        n = self._n + len(xp)
+        if n > len(self._xp):
+            capacity = len(self._xp)
+            while capacity < n:
+                capacity *= 2
+            grown = np.zeros((capacity, len(self.index)), dtype=np.int32)
+            grown[:self._n] = self._xp[:self._n]
+            self._xp = grown
+        self._xp[self._n:n] = xp
+        self._n = n
+
+    def truncate(self, last_year: int) -> None:
+        # forget all years after last_year
+        self._n = self._row(last_year) + 1
+
+    def resume(self, rng: np.random.Generator) -> None:
+        # called before new years are simulated with rng
+        pass
+
+    def keep_options(self, options: dict) -> None:
+        # called before the owners xp options change, rows are stored as is
+        pass
+
+    def values_matrix(self) -> np.ndarray:
+        return xp2val_array(self.matrix, self.index.art)
+
+    def column(self, name: str) -> np.ndarray:
+        # total xp of one stat for every year, a view into the matrix
+        return self.matrix[:, self.index.cols[name]]
+
+    def __json__(self):
+        return {"first_year": self.first_year,
+                "stats": self.index.names,
+                "xp": self.matrix.tolist()}
+
+    @classmethod
+    def from_json(cls, serialized_data, index: StatIndex):
+        first_year = serialized_data["first_year"]
+        xp = np.array(serialized_data["xp"], dtype=np.int32)
+        # saved columns might be in another order than this index
+        cols = [serialized_data["stats"].index(name) for name in index.names]
+        return cls.from_matrix(first_year, xp[:, cols], index)
+
+    @classmethod
+    def from_matrix(cls, first_year: int, xp: np.ndarray, index: StatIndex):
+        # wraps xp without copying, it is copied once the history grows
+        assert xp.ndim == 2 and xp.shape[1] == len(index) and len(xp) > 0
+        history = cls.__new__(cls)
+        history.index = index
+        history.first_year = first_year
+        history._xp = xp
+        history._n = len(xp)
+        return history
+
+def _norm(x: np.ndarray) -> np.ndarray:
+    norm = np.sqrt(np.cumsum(x*x, axis=-1)[..., -1:])
+    return np.where(norm > 0, norm, 1)
+
+def rng_from_state(state: dict) -> np.random.Generator:
+    bit_generator = getattr(np.random, state["bit_generator"])()
+    bit_generator.state = state
+    return np.random.Generator(bit_generator)
+
+# counter based random words, Philox4x32-10 (Salmon et al., Random123) on
+# numpy arrays. counter is (..., 4) and key (..., 2) uint32, broadcast against
+# each other. Any word of a stream can be made without drawing the ones before
+# it, so the years of many characters can be drawn at once and still come out
+# the same as when each is drawn alone
+PHILOX_M = (np.uint64(0xD2511F53), np.uint64(0xCD9E8D57))
+PHILOX_W = (np.uint64(0x9E3779B9), np.uint64(0xBB67AE85))
+
+def philox(counter: np.ndarray, key: np.ndarray) -> np.ndarray:
+    low = np.uint64(0xFFFFFFFF)
+    c0, c1, c2, c3 = (np.asarray(counter[..., i], dtype=np.uint64)
+                      for i in range(4))
+    k0, k1 = (np.asarray(key[..., i], dtype=np.uint64) for i in range(2))
+    for _ in range(10):
+        p0 = c0*PHILOX_M[0]
+        p1 = c2*PHILOX_M[1]
+        c0, c1, c2, c3 = (p1 >> 32) ^ c1 ^ k0, p1 & low, \
+                         (p0 >> 32) ^ c3 ^ k1, p0 & low
+        k0 = (k0 + PHILOX_W[0]) & low
+        k1 = (k1 + PHILOX_W[1]) & low
+    return np.stack(np.broadcast_arrays(c0, c1, c2, c3),
+                    axis=-1).astype(np.uint32)
+
+def stream_key(state: dict) -> np.ndarray:
+    # philox key of a characters yearly draws, from the state of its rng.
+    # Aging doesn't move the rng, the key only changes when it is replaced
+    text = json.dumps(state, sort_keys=True, default=lambda a: a.tolist())
+    digest = hashlib.blake2b(text.encode(), digest_size=8).digest()
+    return np.frombuffer(digest, dtype="<u4").astype(np.uint32)
+
+# words for chunks 0..n-1 of years, keys (... x 2) and years broadcast
+# together to the leading shape of the (... x n x 4) result
+def stream_words(keys: np.ndarray, years, n: int) -> np.ndarray:
+    years = np.asarray(years) % 2**32
+    counter = np.zeros(years.shape + (n, 4), dtype=np.uint32)
+    counter[..., 0] = np.arange(n)
+    counter[..., 1] = years[..., None]
+    return philox(counter, np.asarray(keys)[..., None, :])
+
+# history that keeps a snapshot only every `every` years together with the
+# rng state at that year and the xp options the years after it were drawn
+# with (None while they are the owners current ones), plus the last year. Years in between are
+# regenerated on demand by replaying the owners _step_stats from the closest
+# earlier checkpoint, recently used ones are kept in a small LRU cache.
+# Aging has to call resume with the owners rng before adding years
+class CheckpointHistory(StatHistory):
+    replays = True
+
+    def __init__(self,
+                 first_year: int,
+                 first: StatBlock,
+                 every: int,
+                 owner,
+                 cache_size: int = 32,
+                 ) -> None:
+        assert every > 0
+        self.index = first.index
+        self.first_year = first_year
+        self.every = every
+        self.owner = owner
+        self.cache_size = cache_size
+        self._ck_years = [first_year]
+        self._ck_xp = [first.xp.copy()]
+        self._ck_rng = [None] # set by resume before the first year is simulated
+        self._ck_opts = [None]
+        self._last_year = first_year
+        self._last = first.xp.copy()
+        self._cache = OrderedDict()
+
+    @property
+    def last_year(self) -> int:
+        return self._last_year
+
+    @property
+    def matrix(self) -> np.ndarray:
+        # every year regenerated, expensive for long histories
+        return np.stack([self._get_row(year) for year in self])
+
+    def __len__(self) -> int:
+        return self._last_year - self.first_year + 1
+
+    def __getitem__(self, year: int) -> StatBlock:
+        return StatBlock(self.index, self._get_row(year).copy())
+
+    def __setitem__(self, year: int, stats: StatBlock) -> None:
+        assert stats.index is self.index
+        if year == self._last_year + 1:
+            self.append(stats.xp)
+        elif year == self._last_year == self._ck_years[-1]:
+            self._last = stats.xp.copy()
+            self._ck_xp[-1] = self._last.copy()
+        else: # would make the later years unreplayable
+            raise KeyError(f"Can only add year {self._last_year + 1}")
+
+    def append(self, xp: np.ndarray) -> None:
+        self._last_year += 1
+        self._last = np.array(xp, dtype=np.int32)
+        if self._last_year - self._ck_years[-1] >= self.every:
+            self._add_checkpoint(self.owner.rng)
+
+    def extend(self, xp: np.ndarray) -> None:
+        for row in xp:
+            self.append(row)
+
+    def _add_checkpoint(self, rng: np.random.Generator) -> None:
+        state = copy.deepcopy(rng.bit_generator.state)
+        if self._ck_years[-1] == self._last_year:
+            self._ck_rng[-1] = state
+            self._ck_opts[-1] = None
+            return
+        self._ck_years.append(self._last_year)
+        self._ck_xp.append(self._last.copy())
+        self._ck_rng.append(state)
+        self._ck_opts.append(None)
+
+    def resume(self, rng: np.random.Generator) -> None:
+        # years after the last one are drawn from the stream of rng with the
+        # owners current options. Only if those aren't the ones of the last
+        # checkpoint, like after the rng was replaced or the options changed,
+        # replays past the last year have to start here
+        if self._ck_rng[-1] is None or self._ck_opts[-1] is not None or \
+           not np.array_equal(stream_key(rng.bit_generator.state),
+                              stream_key(self._ck_rng[-1])):
+            self._add_checkpoint(rng)
+
+    def copy(self):
+        # not changed by later changes to this one, for saving it elsewhere.
+        # The arrays and states in the lists are replaced, never changed
+        history = copy.copy(self)
+        history.index = StatIndex(self.index.names, self.index.art)
+        history._ck_years = list(self._ck_years)
+        history._ck_xp = list(self._ck_xp)
+        history._ck_rng = list(self._ck_rng)
+        history._ck_opts = list(self._ck_opts)
+        history._cache = OrderedDict()
+        return history
+
+    def keep_options(self, options: dict) -> None:
+        # the owners options are about to change, the years drawn so far
+        # replay with the ones they had
+        self._ck_opts = [options if o is None else o for o in self._ck_opts]
+
+    def truncate(self, last_year: int) -> None:
+        self._last = self._get_row(last_year).copy()
+        self._last_year = last_year
+        n = bisect.bisect_right(self._ck_years, last_year)
+        del self._ck_years[n:], self._ck_xp[n:], self._ck_rng[n:]
+        del self._ck_opts[n:]
+        for year in [y for y in self._cache if y > last_year]:
+            del self._cache[year]
+
+    def _get_row(self, year: int) -> np.ndarray:
+        if year == self._last_year:
+            return self._last
+        if year in self._cache:
+            self._cache.move_to_end(year)
+            return self._cache[year]
+        if year not in self:
+            raise KeyError(year)
+        n = bisect.bisect_right(self._ck_years, year) - 1
+        if self._ck_years[n] == year:
+            return self._ck_xp[n]
+        return self._replay(n, year)
+
+    def _replay(self, n: int, year: int) -> np.ndarray:
+        owner = self.owner
+        first = self._ck_years[n] + 1
+        key = stream_key(self._ck_rng[n])
+        stats = StatBlock(self.index, self._ck_xp[n].copy())
+        with owner.xp_options_applied(self._ck_opts[n]):
+            words = owner._year_words(key, first, year)
+            for cyear in range(first, year + 1):
+                stats = owner._step_stats(stats,
+                                          owner._get_budget_at_year(cyear),
+                                          words[cyear - first])
+                self._cache[cyear] = stats.xp
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return stats.xp
+
+    def __json__(self):
+        return {"first_year": self.first_year,
+                "stats": self.index.names,
+                "every": self.every,
+                "checkpoints": self._ck_years,
+                "xp": [xp.tolist() for xp in self._ck_xp],
+                "rng": self._ck_rng,
+                "options": self._ck_opts,
+                "last_year": self._last_year,
+                "last": self._last.tolist()}
+
+    @classmethod
+    def from_json(cls, serialized_data, index: StatIndex, owner):
+        cols = [serialized_data["stats"].index(name) for name in index.names]
+        xp = np.array(serialized_data["xp"], dtype=np.int32)[:, cols]
+        history = cls(serialized_data["first_year"],
+                      StatBlock(index, xp[0]),
+                      serialized_data["every"],
+                      owner)
+        history._ck_years = list(serialized_data["checkpoints"])
+        history._ck_xp = list(xp)
+        history._ck_rng = list(serialized_data["rng"])
+        history._ck_opts = list(serialized_data.get("options",
+                                [None]*len(history._ck_years)))
+        history._last_year = serialized_data["last_year"]
+        history._last = np.array(serialized_data["last"],
+                                 dtype=np.int32)[cols]
+        return history
+
 class Character:
+    # learn slower when older than this, budget is multiplied by the factor
+    slow_learning_age = 50
+    slow_learning_factor = 0.75
     # TODO add function support for varying budget based on age
     # TODO add parameters or function support to vary xp distribution
     # TODO determine if any of the input parameters needs to be deepcopied
@@ -133,6 +717,8 @@ class Character:
                  softcapped_stats: dict = None,
                  groups: dict = None,
                  char_info = None, # free field for notes or so
+                 batched: bool = True, # draw a years xp chunks all at once
+                 checkpoint_every: int = None, # history snapshot every n years
                  ) -> None:
         assert char_input_age >= 0
         assert budget > 0
@@ -154,8 +740,12 @@ class Character:
         self.prios = self.norm_prios_by_rel_weight(prios,frac_art_prio_weight)
         self.budget = budget
         self.chunk_mean = chunk_mean
+        self.batched = batched
+        self.checkpoint_every = checkpoint_every
+        if not isinstance(stats, StatBlock):
+            stats = StatBlock.from_dict(stats)
         self.stats = stats
-        self.history = {char_input_year: copy.deepcopy(stats)}
+        self.history = self._new_history(char_input_year, stats)
         if softcapped_stats is None:
             self.softcapped_stats = {}
         else:
@@ -194,24 +784,31 @@ class Character:
     def check_same_keys(dict1, dict2):
         return dict1.keys() == dict2.keys()
 
+    @profiling.profiled("Character.set_to_year")
     def set_to_year(self, year: int):
         assert year >= self.char_input_year
         self._current_year = year
 
         if year in self.history:
-            self.stats = copy.deepcopy(self.history[year])
+            with profiling.stage("history lookup"):
+                self.stats = self.history[year].copy()
         else:
             cyear, cstats = self.get_last_year()
+            with profiling.stage("history resume"):
+                self.history.resume(self.rng)
+            first = cyear + 1
+            words = self._year_words(stream_key(self.rng.bit_generator.state),
+                                     first,
+                                     year)
             while cyear < year:
                 cyear += 1
                 assert cyear not in self.history
-                budget = self.budget
-                if self._get_age_at_year(cyear) > 50: # learn slower over 50
-                    budget = int(budget*0.75)
-                cstats = self._step_stats(cstats, budget)
-                self.history[cyear] = cstats
+                budget = self._get_budget_at_year(cyear)
+                cstats = self._step_stats(cstats, budget, words[cyear - first])
+                with profiling.stage("history store"):
+                    self.history[cyear] = cstats
             assert cyear == year
-            self.stats = copy.deepcopy(cstats)
+            self.stats = cstats.copy()
 
         self._update_age()
 
@@ -219,57 +816,141 @@ class Character:
         assert years > 0
         self.set_to_year(self._current_year + years)
 
-    def _step_stats(self, prev_stats: dict, budget: int) -> dict:
+    @profiling.profiled("Character._step_stats")
+    def _step_stats(self,
+                    prev_stats: StatBlock,
+                    budget: int,
+                    words: np.ndarray,
+                    ) -> StatBlock:
+        # xp of a year added to prev_stats, drawn from the years stream words
         assert self.check_same_keys(prev_stats, self.prios)
-        stats = copy.deepcopy(prev_stats)
-        rng = self.rng
+        stats = prev_stats.copy()
+        names = stats.index.names
+        with profiling.stage("weights"):
+            weight = self._year_weights(stats)
+        if self.batched:
+            with profiling.stage("draw chunks"):
+                stats.xp += self._draw_year(words[None],
+                                            np.array([budget]),
+                                            np.array([self.chunk_mean]),
+                                            weight[None])[0]
+            return stats
+        # start adding xp, one chunk at a time from the same words as the
+        # batched draw, so both give the same stats
         off = int(self.chunk_mean/2) # default chunk offset range
-        # build weight measure
+        low = self.chunk_mean - off
+        cdf = np.cumsum(weight)
+        with profiling.stage("chunk loop"):
+            for word in words:
+                if budget <= 0:
+                    break
+                # xp to add
+                chunk = min(budget, low + (int(word[0])*(2*off + 1) >> 32))
+                # select stat to add to
+                # if we don't use replacement we might get stuck in infinite
+                # loop lets run with replacement for now
+                u = word[1]*2.0**-32*cdf[-1]
+                name = names[int(np.count_nonzero(cdf <= u))]
+                stats.add_xp(name, chunk)
+                budget -= chunk
+        return stats
 
-        temp_stats = dict(sorted(copy.deepcopy(stats).items()))
-        keys = list(temp_stats.keys())
+    def _year_weights(self, stats: StatBlock) -> np.ndarray:
+        # build weight measure
+        art = stats.index.art
+        sts = stats.xp.astype(np.float64)
+        vals = stats.values_array()
         # filter out xp weight of softcapped skills like languages
         # if cap is reached we give no weight from xp, only prio
         for key, cap in self.softcapped_stats.items():
-            if key in temp_stats and temp_stats[key].value >= cap:
-                temp_stats[key] = Ability(0)
+            col = stats.index.cols.get(key)
+            if col is not None and vals[col] >= cap:
+                sts[col] = 0
         # adjust (most often increase) weight from current xp of arts
         # also softcap abilities (weight from xp is capped at val 5 (75xp))
-        for key, stat in temp_stats.items():
-            if isinstance(stat, Art):
-                temp_stats[key].tot_xp *= self.rel_art_xp_weight
-            elif stat.tot_xp > 75:
-                temp_stats[key].tot_xp = 75 # TODO reduce more if needed, expose
-        pri = [weight for key,weight in sorted(self.prios.items())]
-        sts = [int(stat.tot_xp) for stat in temp_stats.values()]
-        weight = self.calc_weights(np.array(sts),
-                                   np.array(pri),
-                                   self.frac_prio2xp_weight)
-        # start adding xp
-        while budget > 0:
-            # xp to add
-            chunk = min(budget,
-                        rng.integers(self.chunk_mean-off,
-                                     self.chunk_mean+off+1))
-            # select stat to add to
-            # if we don't use replacement we might get stuck in infinite loop
-            # lets run with replacement for now
-            key = rng.choice(keys, p=weight/sum(weight))
-            stats[key].add_xp(chunk)
-            budget -= chunk
-        return stats
+        sts[art] *= self.rel_art_xp_weight
+        sts[~art] = np.minimum(sts[~art], 75) # TODO reduce more if needed, expose
+        pri = [self.prios[key] for key in stats.index.names]
+        return self.calc_weights(np.trunc(sts),
+                                 np.array(pri),
+                                 self.frac_prio2xp_weight)
+
+    def _year_words(self,
+                    key: np.ndarray,
+                    first_year: int,
+                    last_year: int,
+                    ) -> np.ndarray:
+        # stream words of the years, enough chunks for the full budget
+        low = self.chunk_mean - int(self.chunk_mean/2)
+        return stream_words(key,
+                            np.arange(first_year, last_year + 1),
+                            -(-self.budget//low))
+
+    @staticmethod
+    def _draw_year(words: np.ndarray,
+                   budgets: np.ndarray,
+                   chunk_means: np.ndarray,
+                   weights: np.ndarray) -> np.ndarray:
+        # xp of one year for rows of characters at once, weights is (rows x
+        # stats) and may be padded with zero columns, words (rows x chunks x
+        # 4) has to cover each budget even if all chunks are minimal. Chunk j
+        # of a row comes from word j: iid chunk sizes with the last one cut
+        # to fit the budget and iid targets drawn with replacement, the same
+        # distribution as the chunk loop
+        n_rows, n_stats = weights.shape
+        off = chunk_means//2
+        low = (chunk_means - off)[:, None]
+        span = (2*off + 1).astype(np.uint64)[:, None]
+        chunks = low + ((words[..., 0]*span) >> np.uint64(32)).astype(np.int64)
+        before = np.cumsum(chunks, axis=1) - chunks
+        chunks = np.clip(budgets[:, None] - before, 0, chunks)
+        # targets by inverse cdf, cumsum runs in order along a row so zero
+        # padding doesn't change it, and never reaches past the last weight
+        cdf = np.cumsum(weights, axis=1)
+        u = words[..., 1]*2.0**-32*cdf[:, -1:]
+        targets = (cdf[:, None, :] <= u[..., None]).sum(axis=2)
+        flat = targets + n_stats*np.arange(n_rows)[:, None]
+        xp = np.bincount(flat.ravel(), weights=chunks.ravel(),
+                         minlength=n_rows*n_stats)
+        return xp.astype(np.int64).reshape(n_rows, n_stats)
 
     @staticmethod
     def calc_weights(sts, pri, frac_prio2xp_weight = 0.5):
-        sts = sts / np.linalg.norm(sts)
-        pri = pri / np.linalg.norm(pri)
+        # normalized along the last axis, rows of several characters at once
+        # with frac_prio2xp_weight a column. The norm adds up in order so
+        # zero padding doesn't change it
+        sts = sts / _norm(sts)
+        pri = pri / _norm(pri)
         # TODO possilly apply function to pri before adding
         w = np.add(sts*(1-frac_prio2xp_weight), pri*frac_prio2xp_weight)
         return w
 
-    def get_last_year(self) -> tuple[int, dict]:
-        year = max(self.history.keys())
-        return year, copy.deepcopy(self.history[max(self.history.keys())])
+    def _new_history(self, first_year: int, stats: StatBlock) -> StatHistory:
+        if self.checkpoint_every:
+            return CheckpointHistory(first_year,
+                                     stats,
+                                     self.checkpoint_every,
+                                     self)
+        return StatHistory(first_year, stats)
+
+    def get_last_year(self) -> tuple[int, StatBlock]:
+        year = self.history.last_year
+        return year, self.history[year].copy()
+
+    def get_progression(self,
+                        name: str,
+                        values: bool = True,
+                        ) -> tuple[np.ndarray, np.ndarray]:
+        # years and value (or total xp) of a stat for every simulated year
+        xp = self.history.column(name)
+        if values:
+            art = self.stats.index.art[self.stats.index.cols[name]]
+            xp = xp2val_array(xp, art)
+        return self.history.years(), xp
+
+    @property
+    def current_year(self) -> int:
+        return self._current_year
 
     def _update_age(self) -> None:
         self.current_age = self._current_year \
@@ -279,6 +960,11 @@ class Character:
     def _get_age_at_year(self, year) -> int:
         return year - self.char_input_year + self.char_input_age
 
+    def _get_budget_at_year(self, year) -> int:
+        if self._get_age_at_year(year) > self.slow_learning_age:
+            return int(self.budget*self.slow_learning_factor)
+        return self.budget
+
     def get_arts_and_abilities(self, stats: dict = None) -> tuple[dict, dict]:
         abilities = {}
         arts = {}
@@ -320,19 +1006,24 @@ class Character:
     def to_dict(self):
         ret = {"Name": self.name, "Age": self.current_age}
         ret |= self.characteristics
-        for key, val in self.stats.items():
-            ret[key] = val.value
+        ret |= self.stats.value_dict()
         for category, group in self.groups.items():
             ret[category] = group
         return ret
 
     def __json__(self):
         # Customize serialization for the Character class
-        abilities, arts = self.get_arts_and_abilities()
-        history = {}
-        for year, sts in self.history.items():
-            ab, ar = self.get_arts_and_abilities(sts)
-            history[year] = {"abilities": ab, "arts": ar}
+        # stats in column order, which swap_stats and rename_stat don't keep
+        # in the name lookup, aging draws depend on it
+        abilities, arts = self.get_arts_and_abilities(
+            {name: self.stats[name] for name in self.stats.index.names})
+        return self.json_meta() | {"abilities": abilities,
+                                   "arts": arts,
+                                   "history": self.history}
+
+    # all of __json__ but the stats and the history, which can be taken from
+    # the arrays instead. The containers are the characters own
+    def json_meta(self) -> dict:
         return {
             "name": self.name,
             "groups": self.groups,
@@ -340,18 +1031,17 @@ class Character:
             "char_input_year": self.char_input_year,
             "char_input_age": self.char_input_age,
             "characteristics": self.characteristics,
-            "abilities": abilities,
-            "arts": arts,
             "prios": self.prios,
-            # "rng": self.rng.bit_generator.state,
+            "rng": self.rng.bit_generator.state if self.rng else None,
             "frac_prio2xp_weight": self.frac_prio2xp_weight,
             "rel_art_xp_weight": self.rel_art_xp_weight,
             "frac_art_prio_weight": self.frac_art_prio_weight,
             "budget": self.budget,
             "chunk_mean": self.chunk_mean,
+            "batched": self.batched,
+            "checkpoint_every": self.checkpoint_every,
             "current_year": self._current_year,
             "softcapped_stats": self.softcapped_stats,
-            "history": history,
         }
 
     @classmethod
@@ -362,10 +1052,24 @@ class Character:
         return stats
 
     @classmethod
-    def from_json(cls, serialized_data):
+    def from_json(cls,
+                  serialized_data,
+                  index: StatIndex = None,
+                  history_xp: np.ndarray = None,
+                  ):
         # Customize deserialization for the Character class
-        stats = cls.stats_from_json(serialized_data["abilities"], Ability)
-        stats |= cls.stats_from_json(serialized_data["arts"], Art)
+        # binary saves pass the stat index and the history matrix instead of
+        # the stats, the current stats are then taken from the history
+        if index is not None:
+            stats = StatBlock(index)
+        else:
+            stats = cls.stats_from_json(serialized_data["abilities"], Ability)
+            stats |= cls.stats_from_json(serialized_data["arts"], Art)
+            # the columns in the order they had when saved, so checkpoints
+            # replay and aging continues with the same draws
+            order = serialized_data["history"].get("stats", list(stats))
+            assert set(order) == set(stats)
+            stats = {name: stats[name] for name in order}
 
         char = cls(
             name=serialized_data["name"],
@@ -382,47 +1086,171 @@ class Character:
             softcapped_stats=serialized_data["softcapped_stats"],
             groups=serialized_data["groups"],
             char_info=serialized_data["char_info"],
+            batched=serialized_data.get("batched", True),
+            checkpoint_every=serialized_data.get("checkpoint_every"),
         )
 
-        for year, stats in serialized_data["history"].items():
-            hstats = cls.stats_from_json(stats["abilities"], Ability)
-            hstats |= cls.stats_from_json(stats["arts"], Art)
-            char.history[int(year)] = hstats
+        history = serialized_data["history"]
+        if history_xp is not None:
+            char.history = StatHistory.from_matrix(history["first_year"],
+                                                   history_xp,
+                                                   char.stats.index)
+        elif "every" in history:
+            char.history = CheckpointHistory.from_json(history,
+                                                       char.stats.index,
+                                                       char)
+        elif "xp" in history:
+            char.history = StatHistory.from_json(history, char.stats.index)
+        else: # saved before version 0.5, one dict per year
+            for year in sorted(history, key=int):
+                stats = history[year]
+                char.history[int(year)] = StatBlock.from_xp(stats["abilities"]
+                                                            | stats["arts"],
+                                                            char.stats.index)
+
+        if serialized_data.get("rng") is not None:
+            char.rng = np.random.default_rng()
+            char.rng.bit_generator.state = serialized_data["rng"]
 
         char.set_to_year(int(serialized_data["current_year"]))
 
         return char
 
     def name2charfield(self, fields: list):
-        abil, arts = self.get_arts_and_abilities()
-        tech, form = self.separate_tech_and_form(arts)
-
-        n2char = {"Name": self.name,
-                  "Age": self.current_age,
-                  "Characteristics": dict2string(self.characteristics),
-                  "Abilities": dict2string(abil),
-                  "Arts": dict2string(arts),
-                  "Techniques": dict2string(tech),
-                  "Forms": dict2string(form),
-                  "House": self.groups["House"],
-                  "Covenant": self.groups["Covenant"],
-                  "Tribunal": self.groups["Tribunal"],
-                  }
-        if self.groups:
-            n2char |= self.groups
-        entry = []
-        for field in fields:
-            if field in n2char:
-                entry.append(n2char[field])
-            else:
-                entry.append("")
-        return entry, n2char
-
-    def reage(self):
-        self.history = {self.char_input_year: copy.deepcopy(self.stats)}
-        self.set_to_year(self._current_year)
-
-    # TODO add method for renaming ability (and fixing it through history)
+        return charfields(self.name,
+                          self.current_age,
+                          self.characteristics,
+                          self.stats.value_dict(art=False),
+                          self.stats.value_dict(art=True),
+                          self.groups,
+                          fields)
+
+    def sortkeys(self) -> dict:
+        values = self.stats.values_array()
+        art = self.stats.index.art
+        names = self.stats.index.names
+        arts = {names[col]: value for col, value
+                in zip(np.flatnonzero(art).tolist(), values[art].tolist())}
+        return charsortkeys(self.name,
+                            self.current_age,
+                            self.characteristics,
+                            int(values[~art].sum()),
+                            arts,
+                            self.groups)
+
+    # bytes used by each part of the character. Objects shared between parts,
+    # like the stat index of stats and history, are counted in the first one.
+    # Stats are kept as xp arrays, Ability objects are only made when asked
+    # for so they are not part of it
+    def memory_usage(self, seen: set = None) -> dict:
+        if seen is None:
+            seen = set()
+        seen.add(id(self)) # a checkpointed history refers back to this
+        usage = {"stats": sizeof(self.stats, seen),
+                 "history": sizeof(self.history, seen),
+                 "prios": sizeof(self.prios, seen)}
+        usage["other"] = sys.getsizeof(self) + sizeof(vars(self), seen)
+        return usage
+
+    # estimated bytes saved by storing the history more compactly
+    def memory_savings(self, every: int = 10) -> dict:
+        history = self.history
+        row = len(self.stats.index)*np.dtype(np.int32).itemsize
+        if history.replays:
+            size = sizeof(history, {id(self), id(history.index)})
+            return {"drop history": max(size - row, 0)}
+        matrix = history.matrix
+        buffer = history.capacity*row
+        size = buffer
+        savings = {"drop history": buffer - row,
+                   "trim history": buffer - matrix.nbytes}
+        if matrix.max(initial=0) < np.iinfo(np.int16).max:
+            savings["int16 history"] = buffer - matrix.nbytes//2
+        # a checkpoint is a row and an rng state, years between are replayed.
+        # Characters loaded without an rng get one before they age
+        rng = self.rng if self.rng is not None else np.random.default_rng()
+        checkpoint = row + sizeof(rng.bit_generator.state)
+        n_checkpoints = -(-len(history)//every) + 1
+        savings[f"checkpoint every {every} years"] = \
+            max(size - n_checkpoints*checkpoint, 0)
+        return savings
+
+    # throws away all simulated years after from_year (default the input
+    # year) and simulates them again up to the current year. With age=False
+    # only the history is cut and the caller has to call set_to_year
+    def reage(self, from_year: int = None, age: bool = True):
+        if from_year is None or from_year < self.char_input_year:
+            from_year = self.char_input_year
+        if from_year < self.history.last_year:
+            self.history.truncate(from_year)
+        if age:
+            self.set_to_year(self._current_year)
+
+    # returns True if any option changed, those need to be reaged
+    def set_xp_options(self,
+                       frac_prio2xp_weight: float,
+                       rel_art_xp_weight: float,
+                       frac_art_prio_weight: float,
+                       budget: int,
+                       ) -> bool:
+        old = (self.frac_prio2xp_weight,
+               self.rel_art_xp_weight,
+               self.frac_art_prio_weight,
+               self.budget)
+        if old == (frac_prio2xp_weight,
+                   rel_art_xp_weight,
+                   frac_art_prio_weight,
+                   budget):
+            return False
+        self.history.keep_options(self.xp_options())
+        self.frac_prio2xp_weight = frac_prio2xp_weight
+        self.rel_art_xp_weight = rel_art_xp_weight
+        if frac_art_prio_weight != self.frac_art_prio_weight:
+            self.frac_art_prio_weight = frac_art_prio_weight
+            self.prios = self.norm_prios_by_rel_weight(self.prios,
+                                                       frac_art_prio_weight)
+        self.budget = budget
+        return True
+
+    # what drawing a year depends on besides the stats and the rng, with the
+    # prios by column so they follow swaps and renames
+    def xp_options(self) -> dict:
+        return {"frac_prio2xp_weight": self.frac_prio2xp_weight,
+                "rel_art_xp_weight": self.rel_art_xp_weight,
+                "budget": self.budget,
+                "prios": [float(self.prios[name])
+                          for name in self.stats.index.names]}
+
+    # options from xp_options in place of the current ones for the block,
+    # None keeps the current ones
+    @contextmanager
+    def xp_options_applied(self, options: dict):
+        if options is None:
+            yield
+            return
+        current = self.xp_options()
+        self._apply_xp_options(options)
+        try:
+            yield
+        finally:
+            self._apply_xp_options(current)
+
+    def _apply_xp_options(self, options: dict) -> None:
+        self.frac_prio2xp_weight = options["frac_prio2xp_weight"]
+        self.rel_art_xp_weight = options["rel_art_xp_weight"]
+        self.budget = options["budget"]
+        for name, prio in zip(self.stats.index.names, options["prios"]):
+            self.prios[name] = prio
+
+    # swaps xp and prio of two stats, through the whole history
+    def swap_stats(self, a: str, b: str) -> None:
+        self.stats.index.swap(a, b)
+        self.prios[a], self.prios[b] = self.prios[b], self.prios[a]
+
+    # renames a stat, through the whole history
+    def rename_stat(self, old: str, new: str) -> None:
+        self.stats.index.rename(old, new)
+        self.prios[new] = self.prios.pop(old)
 
     # TODO add method to add xp without moving year to generate initial stats
 
@@ -436,6 +1264,95 @@ class Character:
     # TODO consider if I need some @x.setter or @x.getter functions to
     # return copies of variables
 
+# the character table row of a character, entry in order of fields
+def charfields(name: str,
+               age: int,
+               characteristics: dict,
+               abil: dict,
+               arts: dict,
+               groups: dict,
+               fields: list,
+               ) -> tuple[list, dict]:
+    tech, form = Character.separate_tech_and_form(arts)
+
+    n2char = {"Name": name,
+              "Age": age,
+              "Characteristics": dict2string(characteristics),
+              "Abilities": dict2string(abil),
+              "Arts": dict2string(arts),
+              "Techniques": dict2string(tech),
+              "Forms": dict2string(form),
+              "House": groups["House"],
+              "Covenant": groups["Covenant"],
+              "Tribunal": groups["Tribunal"],
+              }
+    if groups:
+        n2char |= groups
+    entry = []
+    for field in fields:
+        if field in n2char:
+            entry.append(n2char[field])
+        else:
+            entry.append("")
+    return entry, n2char
+
+# typed values to sort the character table by, like charfields gives the
+# texts. Stat columns sort by the total of their values
+def charsortkeys(name: str,
+                 age: int,
+                 characteristics: dict,
+                 abil_total: int,
+                 arts: dict,
+                 groups: dict,
+                 ) -> dict:
+    tech, form = Character.separate_tech_and_form(arts)
+    keys = {"Name": name,
+            "Age": age,
+            "Characteristics": sum(characteristics.values()),
+            "Abilities": abil_total,
+            "Arts": sum(arts.values()),
+            "Techniques": sum(tech.values()),
+            "Forms": sum(form.values()),
+            }
+    for category, group in (groups or {}).items():
+        keys[category] = "" if group is None else str(group)
+    return keys
+
+# what the character table shows of a character that is not loaded yet,
+# abilities and arts are current values
+class CharacterSummary:
+    def __init__(self,
+                 name: str,
+                 current_age: int,
+                 characteristics: dict,
+                 abilities: dict,
+                 arts: dict,
+                 groups: dict,
+                 ) -> None:
+        self.name = name
+        self.current_age = current_age
+        self.characteristics = characteristics
+        self.abilities = abilities
+        self.arts = arts
+        self.groups = groups
+
+    def name2charfield(self, fields: list):
+        return charfields(self.name,
+                          self.current_age,
+                          self.characteristics,
+                          self.abilities,
+                          self.arts,
+                          self.groups,
+                          fields)
+
+    def sortkeys(self) -> dict:
+        return charsortkeys(self.name,
+                            self.current_age,
+                            self.characteristics,
+                            sum(self.abilities.values()),
+                            self.arts,
+                            self.groups)
+
 def calc_used_xp(array: list, tpe: type) -> int:
     sm = 0
     for val in array:
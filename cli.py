@@ -0,0 +1,206 @@
+import argparse
+import os
+import sys
+import numpy as np
+import char_generator as cg
+import profiling
+import storage
+from character import format_bytes
+from setting import Setting
+
+# command line use without the gui, run as
+#   python cli.py generate 1000 tribunal.npz --seed 7 --workers 8 \
+#       --house Bonisagus Tremere --tribunal Rhine --age 30 120
+# or to see how much memory a setting uses and what compacting it would save
+#   python cli.py memory tribunal.npz --character "Magus 12"
+# or who had a stat of at least a value, and since when
+#   python cli.py query tribunal.npz "Parma Magica" 5 --by 1240 --group House=Tremere
+# or to export every year of the characters to csv
+#   python cli.py export tribunal.npz history.csv --from 1200 --group House=Tremere
+# and with --profile, or --profile-stacks FILE for a flamegraph, to see where
+# the time goes
+
+# names not in the setting yet, numbered after prefix
+def free_names(setting: Setting, prefix: str, n: int) -> list:
+    names = []
+    i = 1
+    while len(names) < n:
+        name = f"{prefix} {i}"
+        if name not in setting.characters:
+            names.append(name)
+        i += 1
+    return names
+
+def generate(args) -> None:
+    if os.path.exists(args.setting):
+        setting = storage.load_setting_file(args.setting)
+    else:
+        name = args.name or os.path.splitext(os.path.basename(args.setting))[0]
+        setting = Setting(name, args.setting, characters={}, groups={},
+                          current_year=args.year, seed=args.seed)
+    year = setting.current_year
+    names = free_names(setting, args.prefix, args.n)
+
+    # ages and groups are drawn here so they also only depend on the seed
+    rng = np.random.default_rng(args.seed)
+    low, high = args.age[0], args.age[-1]
+    ages = rng.integers(low, high, endpoint=True, size=args.n)
+    per_mage = []
+    for age in ages.tolist():
+        groups = {"House": rng.choice(args.house).item(),
+                  "Covenant": rng.choice(args.covenant).item(),
+                  "Tribunal": rng.choice(args.tribunal).item()}
+        # created at gauntlet and aged with the rest of the setting below
+        per_mage.append({"char_input_year": year - age + 25,
+                         "current_year": year - age + 25,
+                         "groups": groups})
+
+    mages = cg.create_mages(names,
+                            seed=args.seed,
+                            workers=args.workers or 1,
+                            per_mage=per_mage,
+                            frac_prio2xp_weight=setting.frac_prio2xp_weight,
+                            rel_art_xp_weight=setting.rel_art_xp_weight,
+                            frac_art_prio_weight=setting.frac_art_prio_weight,
+                            budget=setting.budget)
+    for mage in mages:
+        setting.add_groups(mage.groups)
+        setting.add_character(mage)
+    # without workers all are aged together in this process, which is
+    # fastest on one core, with workers in a process pool. Each ages on its
+    # own rng stream either way, so the result is the same
+    setting.set_year(year, workers=args.workers)
+    storage.save_setting_file(setting, args.setting)
+    print(f"Added {len(mages)} mages to {args.setting}, "
+          f"{len(setting.characters)} characters in {year}")
+
+def memory(args) -> None:
+    setting = storage.load_setting_file(args.setting)
+    if not args.character:
+        print(setting.memory_report(args.every))
+        return
+    for name in args.character:
+        if name not in setting.characters:
+            sys.exit(f"No character {name} in {args.setting}")
+        char = setting.characters[name]
+        print(name)
+        for part, size in char.memory_usage().items():
+            print(f"  {part:28} {format_bytes(size):>10}")
+        print("  Estimated savings")
+        for way, size in char.memory_savings(args.every).items():
+            print(f"  {way:28} {format_bytes(size):>10}")
+
+def export(args) -> None:
+    setting = storage.load_setting_file(args.setting, lazy=True)
+    n = storage.export_history_csv(setting,
+                                   args.csv,
+                                   first=args.first,
+                                   last=args.last,
+                                   groups=dict(args.group),
+                                   wide=args.wide)
+    print(f"Wrote {n} rows to {args.csv}")
+
+def query(args) -> None:
+    setting = storage.load_setting_file(args.setting)
+    reached = setting.history_query().reached(args.stat, args.value,
+                                              by=args.by,
+                                              groups=dict(args.group))
+    for name, year in sorted(reached.items(), key=lambda item: item[1]):
+        print(f"{year} {name}")
+    print(f"{len(reached)} characters had {args.stat} {args.value} or more"
+          + ("" if args.by is None else f" by {args.by}"))
+
+def group_arg(text: str) -> tuple:
+    category, sep, group = text.partition("=")
+    if not sep:
+        raise argparse.ArgumentTypeError("groups are given as CATEGORY=GROUP")
+    return category, group
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(prog="cli.py",
+                                     description="Ars Manager without the gui")
+    parser.add_argument("--profile", action="store_true",
+                        help="print the time spent in each stage afterwards")
+    parser.add_argument("--profile-stacks", metavar="FILE",
+                        help="write the stage times as collapsed stacks for "
+                             "flamegraph tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    gen = commands.add_parser("generate", help="generate and age mages")
+    gen.add_argument("n", type=int, help="number of mages")
+    gen.add_argument("setting",
+                     help="setting file to add them to, created if missing "
+                          "(.json or .npz)")
+    gen.add_argument("--seed", type=int, default=None,
+                     help="gives the same mages and aging every run, with "
+                          "or without --workers")
+    gen.add_argument("--workers", type=int, default=None,
+                     help="processes used to generate and age, the result "
+                          "is the same for any number or without it")
+    gen.add_argument("--age", type=int, nargs="+", default=[25],
+                     metavar="AGE",
+                     help="age, or lowest and highest age (at least 25)")
+    gen.add_argument("--house", nargs="+", default=[""])
+    gen.add_argument("--covenant", nargs="+", default=[""])
+    gen.add_argument("--tribunal", nargs="+", default=[""])
+    gen.add_argument("--prefix", default="Magus",
+                     help="names are the prefix and a number")
+    gen.add_argument("--name", help="name of a new setting")
+    gen.add_argument("--year", type=int, default=1220,
+                     help="current year of a new setting")
+    gen.set_defaults(func=generate)
+
+    mem = commands.add_parser("memory",
+                              help="memory used by a setting and what "
+                                   "compacting its histories would save")
+    mem.add_argument("setting", help="setting file (.json or .npz)")
+    mem.add_argument("--character", nargs="+",
+                     help="only report these characters")
+    mem.add_argument("--every", type=int, default=10,
+                     help="checkpoint interval to estimate, in years")
+    mem.set_defaults(func=memory)
+
+    que = commands.add_parser("query",
+                              help="characters that had a stat of at least "
+                                   "a value, with the first year they did")
+    que.add_argument("setting", help="setting file (.json or .npz)")
+    que.add_argument("stat")
+    que.add_argument("value", type=int)
+    que.add_argument("--by", type=int, help="only the ones that did by then")
+    que.add_argument("--group", type=group_arg, action="append", default=[],
+                     metavar="CATEGORY=GROUP",
+                     help="only characters in the group, can be repeated")
+    que.set_defaults(func=query)
+
+    exp = commands.add_parser("export",
+                              help="write the history of every character "
+                                   "to csv, one row per year and stat")
+    exp.add_argument("setting", help="setting file (.json or .npz)")
+    exp.add_argument("csv", help="file to write")
+    exp.add_argument("--from", dest="first", type=int, help="first year")
+    exp.add_argument("--to", dest="last", type=int, help="last year")
+    exp.add_argument("--group", type=group_arg, action="append", default=[],
+                     metavar="CATEGORY=GROUP",
+                     help="only characters in the group, can be repeated")
+    exp.add_argument("--wide", action="store_true",
+                     help="one row per character and year with a column "
+                          "per stat")
+    exp.set_defaults(func=export)
+
+    args = parser.parse_args(argv)
+    if args.command == "generate":
+        if min(args.age) < 25 or len(args.age) > 2:
+            parser.error("--age takes one or two ages of at least 25")
+        if args.workers is not None and args.workers < 1:
+            parser.error("--workers has to be at least 1")
+    if args.profile or args.profile_stacks:
+        profiling.enable()
+    args.func(args)
+    if args.profile_stacks:
+        profiling.write_collapsed(args.profile_stacks)
+    if args.profile:
+        print(profiling.summary(), file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
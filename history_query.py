@@ -0,0 +1,145 @@
+import numpy as np
+from character import xp2val_array
+
+# questions about stats over the years of a whole setting, like who had
+# Parma Magica 5 by 1240, without changing the year of any character. For
+# every stat asked about one (characters x years) matrix of values is made
+# from the histories, and kept for the next question, so a query is a few
+# array operations. Years a character didn't exist in, or that are after its
+# current year, are MISSING. Group filters use the current groups of the
+# characters. Made and dropped by the setting index (Setting.history_query),
+# lazily loaded characters are loaded
+MISSING = np.iinfo(np.int32).min
+
+class HistoryQuery:
+    def __init__(self, setting) -> None:
+        self.setting = setting
+        self.names = list(setting.characters)
+        self.rows = {name: r for r, name in enumerate(self.names)}
+        chars = [setting.characters[name] for name in self.names]
+        self._spans = [] # (first year, last year) of each character
+        for char in chars:
+            last = min(char.current_year, char.history.last_year)
+            self._spans.append((char.history.first_year, last))
+        self.first_year = min((f for f, _ in self._spans), default=0)
+        self.last_year = max((l for _, l in self._spans), default=-1)
+        self._chars = chars
+        self._columns = {} # stat -> (characters x years) values
+        self._replayed = {} # row -> xp matrix of a checkpointed history
+
+    def __len__(self) -> int:
+        return self.last_year - self.first_year + 1
+
+    def years(self) -> np.ndarray:
+        return np.arange(self.first_year, self.last_year + 1)
+
+    def column(self, stat: str) -> np.ndarray:
+        # values of stat for every character and year, MISSING where unknown
+        if stat not in self._columns:
+            shape = (len(self._chars), len(self))
+            values = np.full(shape, MISSING, dtype=np.int32)
+            # total xp, -1 where unknown, turned into values all at once
+            xp = np.full(shape, -1, dtype=np.int32)
+            art = False
+            for r, (char, (first, last)) in enumerate(zip(self._chars,
+                                                          self._spans)):
+                start = first - self.first_year
+                n = last - first + 1
+                index = char.history.index
+                col = index.cols.get(stat)
+                if col is not None:
+                    xp[r, start:start + n] = self._matrix(r)[:n, col]
+                    art = bool(index.art[col])
+                elif stat in char.characteristics:
+                    values[r, start:start + n] = char.characteristics[stat]
+            known = xp >= 0
+            values[known] = xp2val_array(xp[known], art)
+            self._columns[stat] = values
+        return self._columns[stat]
+
+    def _matrix(self, r: int) -> np.ndarray:
+        # xp of every year of a characters history. A checkpointed one
+        # replays them all, so that is done once for all stats asked about
+        history = self._chars[r].history
+        if not history.replays:
+            return history.matrix
+        if r not in self._replayed:
+            self._replayed[r] = history.matrix
+        return self._replayed[r]
+
+    def _rows(self, groups: dict = None) -> np.ndarray:
+        if not groups:
+            return np.arange(len(self.names))
+        names = self.setting.find_characters(groups=groups)
+        return np.array([self.rows[name] for name in names
+                         if name in self.rows], dtype=np.int64)
+
+    def _col(self, year: int) -> int:
+        return min(max(year - self.first_year, -1), len(self) - 1)
+
+    def values_at(self,
+                  stat: str,
+                  year: int,
+                  groups: dict = None,
+                  ) -> dict:
+        # name -> value in year, for the characters that existed then
+        col = year - self.first_year
+        if col < 0 or col >= len(self):
+            return {}
+        rows = self._rows(groups)
+        values = self.column(stat)[rows, col]
+        known = values != MISSING
+        return dict(zip([self.names[r] for r in rows[known].tolist()],
+                        values[known].tolist()))
+
+    def in_range(self,
+                 stat: str,
+                 year: int,
+                 low: int = None,
+                 high: int = None,
+                 groups: dict = None,
+                 ) -> list:
+        # names with low <= stat <= high in year, sorted
+        return sorted(name for name, value
+                      in self.values_at(stat, year, groups).items()
+                      if (low is None or value >= low) and
+                         (high is None or value <= high))
+
+    def reached(self,
+                stat: str,
+                value: int,
+                by: int = None,
+                groups: dict = None,
+                ) -> dict:
+        # name -> first year stat was at least value, only those that got
+        # there by year by (inclusive) if given
+        rows = self._rows(groups)
+        end = len(self) if by is None else self._col(by) + 1
+        if end <= 0 or len(rows) == 0:
+            return {}
+        hit = self.column(stat)[rows, :end] >= value
+        has = hit.any(axis=1)
+        first = hit.argmax(axis=1)[has] + self.first_year
+        return dict(zip([self.names[r] for r in rows[has].tolist()],
+                        first.tolist()))
+
+    def first_reached(self,
+                      stat: str,
+                      value: int,
+                      groups: dict = None,
+                      ) -> tuple[int, list]:
+        # first year any of the characters had stat at least value and who
+        # did that year, (None, []) if none ever did
+        reached = self.reached(stat, value, groups=groups)
+        if not reached:
+            return None, []
+        year = min(reached.values())
+        return year, sorted(n for n, y in reached.items() if y == year)
+
+    def count_at_least(self,
+                       stat: str,
+                       value: int,
+                       groups: dict = None,
+                       ) -> np.ndarray:
+        # number of characters with stat at least value, for every year
+        return (self.column(stat)[self._rows(groups)] >= value).sum(axis=0)
@@ -0,0 +1,116 @@
+import atexit
+import functools
+import os
+import sys
+import threading
+import time
+from contextlib import nullcontext
+
+# optional timing of named stages in generation, aging, loading and saving,
+# off by default so the stages cost close to nothing. Stages nest, and every
+# path of nested stage names gets a call count and the time spent in it,
+# which can be printed as a table or written as collapsed stacks
+# ("a;b;c microseconds" lines) for flamegraph tools. Turn it on with enable(),
+# the --profile options of cli.py, or by setting ARS_PROFILE to a file name,
+# which writes the stacks there and prints the table when the program exits.
+# Stages run in pool worker processes are not recorded
+_enabled = False
+_lock = threading.Lock()
+_local = threading.local() # stack of open stages, one per thread
+_OFF = nullcontext()
+# (stage, nested stage, ...) -> [calls, seconds, seconds in nested stages]
+records = {}
+
+def enabled() -> bool:
+    return _enabled
+
+def enable() -> None:
+    global _enabled
+    _enabled = True
+
+def disable() -> None:
+    global _enabled
+    _enabled = False
+
+def reset() -> None:
+    with _lock:
+        records.clear()
+
+class _Stage:
+    __slots__ = ("name", "path", "start")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __enter__(self):
+        stack = getattr(_local, "stack", None)
+        if stack is None:
+            stack = _local.stack = []
+        self.path = (stack[-1].path if stack else ()) + (self.name,)
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> bool:
+        elapsed = time.perf_counter() - self.start
+        stack = _local.stack
+        stack.pop()
+        with _lock:
+            record = records.setdefault(self.path, [0, 0.0, 0.0])
+            record[0] += 1
+            record[1] += elapsed
+            if stack:
+                records.setdefault(stack[-1].path, [0, 0.0, 0.0])[2] += elapsed
+        return False
+
+# with profiling.stage("name"): ... times the block when profiling is on
+def stage(name: str):
+    if not _enabled:
+        return _OFF
+    return _Stage(name)
+
+# decorator timing every call of a function as one stage
+def profiled(name: str):
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _Stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def summary() -> str:
+    with _lock:
+        items = sorted((path, list(rec)) for path, rec in records.items())
+    total = sum(rec[1] for path, rec in items if len(path) == 1)
+    lines = [f"{'stage':44} {'calls':>9} {'total s':>10} {'self s':>10} "
+             f"{'per call':>10} {'%':>6}"]
+    for path, (calls, seconds, nested) in items:
+        name = "  "*(len(path) - 1) + path[-1]
+        per_call = seconds/calls if calls else 0.0
+        share = 100*seconds/total if total else 0.0
+        lines.append(f"{name:44} {calls:9d} {seconds:10.4f} "
+                     f"{seconds - nested:10.4f} {per_call:10.6f} {share:6.1f}")
+    return "\n".join(lines)
+
+def write_collapsed(path: str) -> None:
+    # self time of every stage path in whole microseconds
+    with _lock:
+        items = sorted((stack, rec[1] - rec[2])
+                       for stack, rec in records.items())
+    with open(path, "w") as file:
+        for stack, seconds in items:
+            micros = round(seconds*1e6)
+            if micros > 0:
+                file.write(f"{';'.join(stack)} {micros}\n")
+
+def _report_at_exit(path: str) -> None:
+    if records:
+        write_collapsed(path)
+        print(summary(), file=sys.stderr)
+
+if os.environ.get("ARS_PROFILE"):
+    enable()
+    atexit.register(_report_at_exit, os.environ["ARS_PROFILE"])
@@ -0,0 +1,729 @@
+import numpy as np
+import json
+import copy
+import inspect
+from collections.abc import MutableMapping
+import lists_and_data
+import profiling
+from character import Character, CharacterSummary, xp2val_array
+from character import sizeof, format_bytes
+from aging import AgingEngine, age_in_pool
+from history_query import HistoryQuery
+
+def wrapped_default(self, obj):
+    return getattr(obj.__class__, "__json__", wrapped_default.default)(obj)
+wrapped_default.default = json.JSONEncoder().default
+
+# apply the patch
+json.JSONEncoder.original_default = json.JSONEncoder.default
+json.JSONEncoder.default = wrapped_default
+
+def swap_dict_values(dct, a, b):
+    dct[a], dct[b] = dct[b], dct[a]
+
+# characters of a setting that are loaded by load(name) on first access, so a
+# big setting can be opened without building every character. Iterating over
+# values or items loads all of them, peek gives what summarize(name) returns
+# for a character not loaded yet, for showing it without loading it. source
+# is for the loader to know its own mappings. Characters saved without an
+# rng state (before version 0.5) get one from spawn_rng when loaded, like
+# Setting.__init__ gives them. release(name) is called when a character is
+# kept loaded, for the loader to drop what it only needed to build it.
+# payload(name) gives a function building a character from a copy of what it
+# was saved as, that can be called from another thread, for saving
+# characters that aren't loaded without loading them. defer(fix) applies
+# fix(char) to every character not loaded yet once it is
+class LazyCharacters(MutableMapping):
+    def __init__(self,
+                 names: list,
+                 load,
+                 summarize = None,
+                 source = None,
+                 spawn_rng = None,
+                 release = None,
+                 payload = None,
+                 ) -> None:
+        self.load = load
+        self.summarize = summarize
+        self.source = source
+        self.spawn_rng = spawn_rng
+        self.release = release
+        self.payload = payload
+        self.fixes = []
+        self._names = dict.fromkeys(names)
+        self._loaded = {}
+        self.deleted = set()
+
+    def __getitem__(self, name: str) -> Character:
+        if name not in self._loaded:
+            if name not in self._names:
+                raise KeyError(name)
+            char = self._fixed(self.load(name))
+            if char.rng is None and self.spawn_rng is not None:
+                char.rng = self.spawn_rng()
+            self._loaded[name] = char
+            if self.release is not None:
+                self.release(name)
+        return self._loaded[name]
+
+    def __setitem__(self, name: str, char: Character) -> None:
+        self._names[name] = None
+        self._loaded[name] = char
+        self.deleted.discard(name)
+
+    def __delitem__(self, name: str) -> None:
+        del self._names[name]
+        self._loaded.pop(name, None)
+        self.deleted.add(name)
+
+    def __contains__(self, name) -> bool:
+        return name in self._names
+
+    def __iter__(self):
+        return iter(list(self._names))
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def loaded(self) -> dict:
+        return dict(self._loaded)
+
+    def get_transient(self, name: str) -> Character:
+        # the character without keeping it loaded if it isn't already, for
+        # going through all of them once without holding them all
+        if name in self._loaded:
+            return self._loaded[name]
+        if name not in self._names:
+            raise KeyError(name)
+        return self._fixed(self.load(name))
+
+    def defer(self, fix) -> None:
+        # for changes to every character without loading them, the loaded
+        # ones have to be changed by the caller
+        self.fixes.append(fix)
+
+    def _fixed(self, char: Character, fixes: list = None) -> Character:
+        for fix in self.fixes if fixes is None else fixes:
+            fix(char)
+        return char
+
+    def unloaded_payload(self, name: str):
+        # payload of a character that isn't loaded, None if it is loaded or
+        # the loader has none
+        if name in self._loaded or self.payload is None:
+            return None
+        if name not in self._names:
+            raise KeyError(name)
+        build, fixes = self.payload(name), list(self.fixes)
+        return lambda: self._fixed(build(), fixes)
+
+    def peek(self, name: str):
+        summary = None
+        if name not in self._loaded and self.summarize is not None:
+            summary = self.summarize(name) # None if it has to be loaded
+        return self[name] if summary is None else summary
+
+    def __json__(self):
+        return dict(self.items())
+
+# indexes for finding characters of a setting without going through all of
+# them: names by group category and group, and for every stat (and
+# characteristic) the values at the current year sorted, together with the
+# id of the character of each. Built on first use from character_rows, so
+# lazily loaded characters stay unloaded, and then kept up to date by the
+# setting as characters are added or edited. A year change only drops the
+# stat part, it is built again when next needed
+class CharacterIndex:
+    def __init__(self, setting) -> None:
+        self.setting = setting
+        self._source = None # characters mapping the indexes were built from
+        self._reset()
+
+    def _reset(self) -> None:
+        self._groups = None # category -> group -> set of names
+        self._char_groups = {} # name -> groups it is indexed under
+        self._stats = None # stat -> (sorted values, ids in the same order)
+        self._ids = {} # name -> id in the stat arrays
+        self._names = [] # id -> name
+        self._history = None # HistoryQuery, made again after any change
+
+    def _check_source(self) -> None:
+        # the characters can be replaced as a whole, like by a loader
+        if self.setting.characters is not self._source:
+            self._reset()
+            self._source = self.setting.characters
+
+    def _id(self, name: str) -> int:
+        if name not in self._ids:
+            self._ids[name] = len(self._names)
+            self._names.append(name)
+        return self._ids[name]
+
+    @staticmethod
+    def stat_values(char) -> dict:
+        # values of a character or a CharacterSummary by stat name
+        values = dict(char.characteristics)
+        if isinstance(char, CharacterSummary):
+            values |= char.abilities
+            values |= char.arts
+        else:
+            values |= char.stats.value_dict()
+        return values
+
+    def _add_groups(self, name: str, groups: dict) -> None:
+        groups = dict(groups or {})
+        self._char_groups[name] = groups
+        for category, group in groups.items():
+            self._groups.setdefault(category, {}) \
+                        .setdefault(group, set()).add(name)
+
+    def _build_groups(self) -> None:
+        self._groups = {}
+        for name, char in self.setting.character_rows().items():
+            self._add_groups(name, char.groups)
+
+    def _build_stats(self) -> None:
+        # all values in one (characters x stats) matrix over the union of the
+        # stat names, which is then sorted column by
+        # column. Characters with the same stats share their column map
+        # Loaded characters give total xp, turned into values all at once
+        cols = {}
+        art = {}
+        maps = {}
+        rows = []
+        for name, char in self.setting.character_rows().items():
+            if isinstance(char, CharacterSummary):
+                values = char.characteristics | char.abilities | char.arts
+                names, values, n_xp = tuple(values), list(values.values()), 0
+            else:
+                index = char.stats.index
+                names = tuple(index.names) + tuple(char.characteristics)
+                values = char.stats.xp.tolist() + \
+                         list(char.characteristics.values())
+                n_xp = len(index)
+                for stat, is_art in zip(index.names, index.art.tolist()):
+                    art[stat] = is_art
+            cmap = maps.get(names)
+            if cmap is None:
+                for stat in names:
+                    cols.setdefault(stat, len(cols))
+                cmap = maps[names] = np.array([cols[stat] for stat in names],
+                                              dtype=np.int64)
+            rows.append((self._id(name), cmap, values, n_xp))
+        matrix = np.zeros((len(rows), len(cols)), dtype=np.int32)
+        present = np.zeros((len(rows), len(cols)), dtype=bool)
+        is_xp = np.zeros((len(rows), len(cols)), dtype=bool)
+        for r, (_, cmap, values, n_xp) in enumerate(rows):
+            matrix[r, cmap] = values
+            present[r, cmap] = True
+            is_xp[r, cmap[:n_xp]] = True
+        art_cols = np.zeros(len(cols), dtype=bool)
+        for stat, is_art in art.items():
+            art_cols[cols[stat]] = is_art
+        xp = np.where(is_xp, matrix, 0)
+        matrix = np.where(is_xp, xp2val_array(xp, art_cols), matrix)
+        ids = np.array([i for i, _, _, _ in rows], dtype=np.int32)
+        self._stats = {}
+        for stat, col in cols.items():
+            have = np.flatnonzero(present[:, col])
+            vals = matrix[have, col]
+            order = np.argsort(vals, kind="stable")
+            self._stats[stat] = (vals[order], ids[have][order])
+
+    def _groups_index(self) -> dict:
+        self._check_source()
+        if self._groups is None:
+            self._build_groups()
+        return self._groups
+
+    def _stats_index(self) -> dict:
+        self._check_source()
+        if self._stats is None:
+            self._build_stats()
+        return self._stats
+
+    def members(self, category: str, group: str) -> set:
+        return set(self._groups_index().get(category, {}).get(group, ()))
+
+    def stat_range(self,
+                   stat: str,
+                   low: int = None,
+                   high: int = None,
+                   ) -> list:
+        # names of characters with low <= stat <= high, by increasing value
+        vals, ids = self._stats_index().get(stat, (np.zeros(0), np.zeros(0)))
+        start = 0 if low is None else np.searchsorted(vals, low, "left")
+        end = len(vals) if high is None else \
+              np.searchsorted(vals, high, "right")
+        return [self._names[i] for i in ids[start:end].tolist()]
+
+    def find(self, groups: dict = None, stats: dict = None) -> list:
+        # names in all groups (category -> group) with all stats in their
+        # ranges (stat -> (low, high), None for no bound), sorted
+        found = None
+        for category, group in (groups or {}).items():
+            members = self.members(category, group)
+            found = members if found is None else found & members
+        for stat, (low, high) in (stats or {}).items():
+            if found is not None and not found:
+                break
+            names = set(self.stat_range(stat, low, high))
+            found = names if found is None else found & names
+        if found is None:
+            found = set(self.setting.characters)
+        return sorted(found)
+
+    def history(self) -> HistoryQuery:
+        self._check_source()
+        if self._history is None:
+            self._history = HistoryQuery(self.setting)
+        return self._history
+
+    def remove(self, name: str) -> None:
+        self._check_source()
+        self._history = None
+        if self._groups is not None and name in self._char_groups:
+            for category, group in self._char_groups.pop(name).items():
+                self._groups[category][group].discard(name)
+        if self._stats is not None and name in self._ids:
+            i = self._ids[name]
+            for stat, (vals, ids) in self._stats.items():
+                keep = ids != i
+                if not keep.all():
+                    self._stats[stat] = (vals[keep], ids[keep])
+
+    def add(self, name: str) -> None:
+        self._check_source()
+        self._history = None
+        if self._groups is None and self._stats is None:
+            return # built with it when needed
+        char = self.setting.characters[name]
+        if self._groups is not None:
+            self._add_groups(name, char.groups)
+        if self._stats is not None:
+            i = self._id(name)
+            for stat, value in self.stat_values(char).items():
+                vals, ids = self._stats.get(stat, (np.zeros(0, np.int32),
+                                                   np.zeros(0, np.int32)))
+                pos = np.searchsorted(vals, value, "right")
+                self._stats[stat] = (np.insert(vals, pos, value),
+                                     np.insert(ids, pos, i))
+
+    def update(self, name: str) -> None:
+        self.remove(name)
+        if name in self.setting.characters:
+            self.add(name)
+
+    def year_changed(self) -> None:
+        self._stats = None
+        self._history = None
+
+class Setting:
+    def __init__(self,
+                 name: str,
+                 save_name: str,
+                 characters: dict = {},
+                 groups: dict = {},
+                 rng = None,
+                 current_year: int = 1220,
+                 frac_prio2xp_weight: float = None,
+                 rel_art_xp_weight: float = None,
+                 frac_art_prio_weight: float = None,
+                 budget: int = None,
+                 ability_ordering: dict = None,
+                 softcapped_stats: dict = None,
+                 seed: int = None,
+                 n_spawned: int = 0,
+                 journal_seq: int = 0,
+                 ) -> None:
+        self.version = 0.5 # used to track how json save looks like and handle updates
+        self.name = name
+        self.save_name = save_name
+        self.characters = characters # contains all setting characters
+        # groups: Keys are group categories, like covenant or house, values
+        # are possibly dicts themselves with a name as key for each group in
+        # the category and other info about the group in that dict
+        # for now we track group membership on the characters, but we should
+        # make sure that all groups on characters exist here (or that we only
+        # add a group to a character from this dict of options)
+        self.groups = groups
+        self.current_year = current_year
+        if ability_ordering is None:
+            self.ability_ordering = copy.deepcopy(lists_and_data.DEFAULT_ABIL_ORDERING)
+        else:
+            self.ability_ordering = ability_ordering
+        d_char_v = inspect.signature(Character.__init__).parameters
+        if frac_prio2xp_weight is None:
+            self.frac_prio2xp_weight = d_char_v["frac_prio2xp_weight"].default
+        else:
+            self.frac_prio2xp_weight = frac_prio2xp_weight
+        if rel_art_xp_weight is None:
+            self.rel_art_xp_weight = d_char_v["rel_art_xp_weight"].default
+        else:
+            self.rel_art_xp_weight = rel_art_xp_weight
+        if frac_art_prio_weight is None:
+            self.frac_art_prio_weight = d_char_v["frac_art_prio_weight"].default
+        else:
+            self.frac_art_prio_weight = frac_art_prio_weight
+        if budget is None:
+            self.budget = d_char_v["budget"].default
+        else:
+            self.budget = budget
+        if softcapped_stats is None: # TODO also make sure all languages are there
+            self.softcapped_stats = copy.deepcopy(lists_and_data.SOFTCAPPED_STATS)
+        else:
+            self.softcapped_stats = softcapped_stats
+
+        # every character gets its own rng stream spawned from this, so
+        # aging results don't depend on the order characters are aged in
+        self.seed_seq = np.random.SeedSequence(seed,
+                                               n_children_spawned=n_spawned)
+        # rng of the setting itself, kept in saves for randomness that isn't
+        # any one characters. Aging doesn't use it, characters age on their
+        # own rngs. Also from the seed, so a seeded setting is the same
+        if rng is None:
+            self.rng = self.spawn_rng()
+        else:
+            self.rng = rng
+        for _, char in self.characters.items():
+            if char.rng is None:
+                char.rng = self.spawn_rng()
+        # number of the last journaled change included in this state, see
+        # storage.Journal
+        self.journal_seq = journal_seq
+        self.index = CharacterIndex(self)
+        # names of characters added, modified and removed since the views
+        # last took the changes, all_changed when every character may have
+        # changed (a new setting or a year change), see take_changes
+        self.added = set()
+        self.modified = set()
+        self.removed = set()
+        self.all_changed = True
+
+    def spawn_rng(self) -> np.random.Generator:
+        return np.random.default_rng(self.seed_seq.spawn(1)[0])
+
+    def __json__(self):
+        # Customize serialization for the Character class
+        return {
+            "version": self.version,
+            "name": self.name,
+            "save_name": self.save_name,
+            "characters": self.characters,
+            "groups": self.groups,
+            "rng": self.rng.bit_generator.state,
+            "seed": self.seed_seq.entropy,
+            "n_spawned": self.seed_seq.n_children_spawned,
+            "journal_seq": self.journal_seq,
+            "current_year": self.current_year,
+            "frac_prio2xp_weight": self.frac_prio2xp_weight,
+            "rel_art_xp_weight": self.rel_art_xp_weight,
+            "frac_art_prio_weight": self.frac_art_prio_weight,
+            "budget": self.budget,
+            "ability_ordering": self.ability_ordering,
+            "softcapped_stats": self.softcapped_stats,
+        }
+
+    @classmethod
+    @profiling.profiled("Setting.from_json")
+    def from_json(cls, serialized_data, characters: dict = None):
+        # if needed use serialized_data["version"] to do recovery behaviour
+        # characters can be given already loaded, like from a binary save
+        chars = characters
+        if chars is None:
+            chars = {}
+            with profiling.stage("Character.from_json"):
+                for _, char in serialized_data["characters"].items():
+                    chars[char["name"]] = Character.from_json(char)
+        rng = None
+        if "rng" in serialized_data:
+            rng = np.random.default_rng()
+            rng.bit_generator.state = serialized_data["rng"]
+        return cls(
+            name=serialized_data["name"],
+            save_name=serialized_data["save_name"],
+            characters=chars,
+            groups=serialized_data["groups"],
+            rng=rng,
+            current_year=serialized_data["current_year"],
+            frac_prio2xp_weight=serialized_data.get("frac_prio2xp_weight"),
+            rel_art_xp_weight=serialized_data.get("rel_art_xp_weight"),
+            frac_art_prio_weight=serialized_data.get("frac_art_prio_weight"),
+            budget=serialized_data.get("budget"),
+            ability_ordering=serialized_data.get("ability_ordering"),
+            softcapped_stats=serialized_data.get("softcapped_stats"),
+            seed=serialized_data.get("seed"),
+            n_spawned=serialized_data.get("n_spawned", 0),
+            journal_seq=serialized_data.get("journal_seq", 0),
+        )
+
+    def add_character(self,
+                      char: Character,
+                      replace: bool = False,
+                      ) -> bool:
+        if char in self.characters and not replace:
+            print("A character with this name already exists. "
+                  "Set replace to True if you want to overwrite.")
+            return False
+        char.rng = self.spawn_rng()
+        new = char.name not in self.characters
+        self.characters[char.name] = char
+        self._character_changed(char.name, new)
+        return True
+
+    def remove_character(self, name: str) -> bool:
+        if name not in self.characters:
+            return False
+        del self.characters[name]
+        self.index.update(name)
+        self.added.discard(name)
+        self.modified.discard(name)
+        self.removed.add(name)
+        return True
+
+    def _character_changed(self, name: str, new: bool = False) -> None:
+        self.index.update(name)
+        if new and name not in self.removed:
+            self.added.add(name)
+        elif name not in self.added:
+            self.removed.discard(name)
+            self.modified.add(name)
+
+    def take_changes(self) -> tuple[set, set, set, bool]:
+        # (added, modified, removed, all_changed) since last called, and
+        # start over tracking
+        changes = (self.added, self.modified, self.removed, self.all_changed)
+        self.added = set()
+        self.modified = set()
+        self.removed = set()
+        self.all_changed = False
+        return changes
+
+    def add_groups(self, groups: dict):
+        # add groups of a character to the setting if not already there
+        for category, group in groups.items():
+            if category not in self.groups:
+                self.groups[category] = {group: None}
+            if group not in self.groups[category]:
+                self.groups[category][group] = None
+
+    # changes small enough to be journaled instead of saving everything,
+    # a year change is redone by aging again which gives the same result
+    # as every rng state is part of the save
+    def year_change(self) -> dict:
+        return {"op": "year", "year": self.current_year}
+
+    def character_change(self, name: str, new: bool = False) -> dict:
+        return {"op": "character",
+                "character": self.characters[name].__json__(),
+                "new": new}
+
+    def apply_change(self, change: dict):
+        # redo a change made by year_change or character_change
+        if change["op"] == "year":
+            self.set_year(change["year"])
+        elif change["op"] == "character":
+            char = Character.from_json(change["character"])
+            new = char.name not in self.characters
+            if change["new"]:
+                self.seed_seq.spawn(1) # the stream it got in add_character
+                self.add_groups(char.groups)
+            self.characters[char.name] = char
+            self._character_changed(char.name, new)
+        else:
+            raise ValueError(f"Unknown change {change['op']}")
+
+    def character_edited(self, name: str):
+        # call after changing a characters stats or groups in place
+        self._character_changed(name)
+
+    def stat_in_use(self, stat: str, besides: str = None) -> bool:
+        # whether any character but besides has stat, from the index so
+        # characters that aren't loaded stay that way
+        return any(name != besides for name in self.index.stat_range(stat))
+
+    def set_softcap(self, stat: str, cap: int = None) -> None:
+        # softcap of stat for the setting and every character, None removes
+        # it. Characters that aren't loaded get it when they are
+        def apply(char: Character):
+            if cap is None:
+                char.softcapped_stats.pop(stat, None)
+            else:
+                char.softcapped_stats[stat] = cap
+        if cap is None:
+            self.softcapped_stats.pop(stat, None)
+        else:
+            self.softcapped_stats[stat] = cap
+        for char in self._loaded_characters().values():
+            apply(char)
+        if isinstance(self.characters, LazyCharacters):
+            self.characters.defer(apply)
+
+    def find_characters(self,
+                        groups: dict = None,
+                        stats: dict = None,
+                        ) -> list:
+        # like find_characters({"House": "Flambeau", "Tribunal": "Rhine"},
+        #                      {"Ig": (10, None)}), see CharacterIndex.find
+        return self.index.find(groups, stats)
+
+    def history_query(self) -> HistoryQuery:
+        # for questions over every year, like
+        # history_query().reached("Parma Magica", 5, by=1240)
+        return self.index.history()
+
+    def get_character(self,
+                      name: str,
+                      ) -> Character:
+        if name in self.characters:
+            return self.characters[name]
+        else:
+            return None
+
+    def add_years(self,
+                  years: int,
+                  batch: bool = True,
+                  workers: int = None):
+        self.current_year += years
+        self._age_characters(self.current_year, batch, workers)
+
+    def set_year(self,
+                 year: int,
+                 batch: bool = True,
+                 workers: int = None):
+        self.current_year = year
+        self._age_characters(year, batch, workers)
+
+    def _age_characters(self,
+                        year: int,
+                        batch: bool = True,
+                        workers: int = None):
+        # every character ages on its own rng stream, and the result is the
+        # same either way. With workers they are aged in a process pool,
+        # otherwise with batch all missing years are simulated for all
+        # characters together, and without it each character ages itself in
+        # set_to_year
+        if workers:
+            age_in_pool(self.characters.values(), year, workers)
+        elif batch:
+            AgingEngine(self.characters.values()).age_to(year)
+        for char in self.characters.values():
+            char.set_to_year(year)
+        self.index.year_changed()
+        self.all_changed = True
+
+    def character_rows(self) -> dict:
+        # what the character table needs of every character, without
+        # loading the ones that are not loaded yet
+        if isinstance(self.characters, LazyCharacters):
+            return {name: self.characters.peek(name)
+                    for name in self.characters}
+        return self.characters
+
+    def character_row(self, name: str):
+        # what the character table needs of one character, see character_rows
+        if isinstance(self.characters, LazyCharacters):
+            return self.characters.peek(name)
+        return self.characters[name]
+
+    def _loaded_characters(self) -> dict:
+        if isinstance(self.characters, LazyCharacters):
+            return self.characters.loaded()
+        return self.characters
+
+    # bytes of each part summed over the loaded characters, objects shared
+    # between characters counted once, and of the setting itself. Characters
+    # not loaded yet only count with their name in "setting"
+    def memory_usage(self) -> dict:
+        usage = {}
+        seen = set()
+        chars = self._loaded_characters()
+        for char in chars.values():
+            for part, size in char.memory_usage(seen).items():
+                usage[part] = usage.get(part, 0) + size
+        usage["setting"] = sizeof(self, seen)
+        return usage
+
+    def memory_savings(self, every: int = 10) -> dict:
+        savings = {}
+        for char in self._loaded_characters().values():
+            for way, size in char.memory_savings(every).items():
+                savings[way] = savings.get(way, 0) + size
+        return savings
+
+    def memory_report(self, every: int = 10) -> str:
+        usage = self.memory_usage()
+        total = sum(usage.values())
+        n_loaded = len(self._loaded_characters())
+        per_char = max(n_loaded, 1)
+        lines = [f"{self.name}: {format_bytes(total)}, "
+                 f"{n_loaded} of {len(self.characters)} characters loaded",
+                 f"{'':28} {'total':>10} {'per char':>10} {'share':>6}"]
+        for part, size in usage.items():
+            share = "" if part == "setting" else format_bytes(size/per_char)
+            lines.append(f"{part:28} {format_bytes(size):>10} {share:>10} "
+                         f"{size/max(total, 1):6.1%}")
+        lines.append("Estimated savings")
+        for way, size in self.memory_savings(every).items():
+            lines.append(f"{way:28} {format_bytes(size):>10} "
+                         f"{format_bytes(size/per_char):>10} "
+                         f"{size/max(total, 1):6.1%}")
+        return "\n".join(lines)
+
+    def characters2csv_headers(self) -> list:
+        headers = [str(self.current_year), "Age"]
+        headers += lists_and_data.CHARACTERISTICS
+        headers += lists_and_data.TECHNIQUES
+        headers += lists_and_data.FORMS
+        for _, area in self.ability_ordering.items():
+            headers += area
+        headers += list(self.groups.keys())
+        return headers
+
+    def set_xp_options(self,
+                       p2x,
+                       art_xp,
+                       f_art_prio,
+                       budget,
+                       reage=False,
+                       from_year: int = None,
+                       batch: bool = True,
+                       workers: int = None):
+        # with reage, characters whose options changed get all years after
+        # from_year (default their input year) simulated again, the others
+        # and earlier years are kept. Returns names of reaged characters
+        self.frac_prio2xp_weight = p2x
+        self.rel_art_xp_weight = art_xp
+        self.frac_art_prio_weight = f_art_prio
+        self.budget = budget
+        if not reage:
+            return []
+        changed = []
+        for name, char in self.characters.items():
+            if char.set_xp_options(p2x, art_xp, f_art_prio, budget):
+                char.reage(from_year, age=False)
+                changed.append(name)
+        self._age_characters(self.current_year, batch, workers)
+        return changed
+
+    def find_ordering_of_ability(self, ab_name):
+        for cat, values in self.ability_ordering.items():
+            if ab_name in values:
+                return cat
+        return "Other"
+
+    def get_all_abilities(self, dict_to_check=None):
+        if dict_to_check is None:
+            dict_to_check = self.ability_ordering
+        ret = []
+        for cat, values in dict_to_check.items():
+            ret += values
+        return ret
+
+    def sort_abilies_by_ordering(self, to_sort):
+        ret = []
+        for category in self.ability_ordering.values():
+            for name in category:
+                if name in to_sort:
+                    ret.append(name)
+        return ret
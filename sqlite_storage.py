@@ -0,0 +1,262 @@
+import numpy as np
+import json
+import sqlite3
+from character import Character, StatIndex, xp2val_array
+from setting import Setting, LazyCharacters
+
+# optional storage of many settings in one sqlite database, with characters,
+# their group memberships and every years stats in their own tables so they
+# can be queried across settings. Characters are only loaded from the
+# database when used, and saving only writes rows that changed since the
+# character was loaded or last saved. Loaded settings get their characters
+# as a LazyCharacters mapping
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS settings (
+    id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL,
+    meta TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS characters (
+    id INTEGER PRIMARY KEY,
+    setting_id INTEGER NOT NULL REFERENCES settings(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    meta TEXT NOT NULL,
+    stats TEXT NOT NULL, -- json list of stat names in column order
+    art TEXT NOT NULL, -- json list, true for the arts
+    first_year INTEGER NOT NULL,
+    UNIQUE (setting_id, name)
+);
+CREATE TABLE IF NOT EXISTS memberships (
+    character_id INTEGER NOT NULL REFERENCES characters(id) ON DELETE CASCADE,
+    category TEXT NOT NULL,
+    group_name TEXT,
+    PRIMARY KEY (character_id, category)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS memberships_by_group
+    ON memberships (category, group_name);
+CREATE TABLE IF NOT EXISTS stats (
+    character_id INTEGER NOT NULL REFERENCES characters(id) ON DELETE CASCADE,
+    year INTEGER NOT NULL,
+    stat TEXT NOT NULL,
+    xp INTEGER NOT NULL,
+    value INTEGER NOT NULL,
+    PRIMARY KEY (character_id, year, stat)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS stats_by_value ON stats (stat, year, value);
+"""
+
+class SqliteStore:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.executescript(SCHEMA)
+        # what was last loaded or saved for each character id, to only
+        # write what changed: (metadata json, stat names, first year, xp)
+        self._saved = {}
+
+    def close(self):
+        self.conn.close()
+
+    def setting_names(self) -> list:
+        rows = self.conn.execute("SELECT name FROM settings ORDER BY name")
+        return [name for name, in rows]
+
+    def save_setting(self, setting: Setting):
+        meta = setting.__json__()
+        del meta["characters"]
+        with self.conn: # one transaction
+            self.conn.execute(
+                "INSERT INTO settings (name, meta) VALUES (?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET meta = excluded.meta",
+                (setting.name, json.dumps(meta)))
+            setting_id, = self.conn.execute(
+                "SELECT id FROM settings WHERE name = ?",
+                (setting.name,)).fetchone()
+            chars = setting.characters
+            if isinstance(chars, LazyCharacters) and \
+               chars.source == (self, setting_id):
+                # characters never loaded can't have changed, other than by
+                # deferred fixes
+                deleted = chars.deleted
+                if chars.fixes:
+                    chars = {name: chars.get_transient(name) for name in chars}
+                else:
+                    chars = chars.loaded()
+            else:
+                rows = self.conn.execute(
+                    "SELECT name FROM characters WHERE setting_id = ?",
+                    (setting_id,))
+                deleted = {name for name, in rows} - set(chars)
+            for name in deleted:
+                self.conn.execute(
+                    "DELETE FROM characters WHERE setting_id = ? AND name = ?",
+                    (setting_id, name))
+            for char in chars.values():
+                self._save_character(setting_id, char)
+        if isinstance(setting.characters, LazyCharacters):
+            setting.characters.deleted.clear()
+            if setting.characters.source == (self, setting_id):
+                setting.characters.fixes.clear() # in the database now
+
+    @staticmethod
+    def _meta_json(char: Character) -> str:
+        meta = char.json_meta() # the stats are in the stats table
+        history = char.history
+        if history.replays: # small, kept whole with the metadata
+            meta["history"] = history
+        else:
+            meta["history"] = {"first_year": history.first_year}
+        return json.dumps(meta)
+
+    def _save_character(self, setting_id: int, char: Character):
+        history = char.history
+        meta_json = self._meta_json(char)
+        index = char.stats.index
+        names = list(index.names)
+        row = self.conn.execute(
+            "SELECT id FROM characters WHERE setting_id = ? AND name = ?",
+            (setting_id, char.name)).fetchone()
+        if row is None:
+            char_id = self.conn.execute(
+                "INSERT INTO characters (setting_id, name, meta, stats, art, "
+                "first_year) VALUES (?, ?, ?, ?, ?, ?)",
+                (setting_id, char.name, meta_json, json.dumps(names),
+                 json.dumps(index.art.tolist()), history.first_year)).lastrowid
+        else:
+            char_id, = row
+        saved = self._saved.get(char_id)
+        if saved is not None and history.replays and saved[0] == meta_json:
+            return # its whole history is in the metadata
+        if saved is None or saved[0] != meta_json or saved[1] != names:
+            self.conn.execute(
+                "UPDATE characters SET meta = ?, stats = ?, art = ?, "
+                "first_year = ? WHERE id = ?",
+                (meta_json, json.dumps(names), json.dumps(index.art.tolist()),
+                 history.first_year, char_id))
+            self.conn.execute("DELETE FROM memberships WHERE character_id = ?",
+                              (char_id,))
+            self.conn.executemany(
+                "INSERT INTO memberships VALUES (?, ?, ?)",
+                [(char_id, category, group)
+                 for category, group in (char.groups or {}).items()])
+        xp = history.matrix.copy()
+        self._write_stats(char_id, history.first_year, names, index.art, xp,
+                          saved)
+        self._saved[char_id] = (meta_json, names, history.first_year, xp)
+
+    def _write_stats(self,
+                     char_id: int,
+                     first_year: int,
+                     names: list,
+                     art: np.ndarray,
+                     xp: np.ndarray,
+                     saved: tuple,
+                     ):
+        values = xp2val_array(xp, art)
+        old = None
+        if saved is not None and saved[3] is not None and \
+           saved[2] == first_year and set(saved[1]) == set(names):
+            cols = [saved[1].index(name) for name in names]
+            old = saved[3][:, cols]
+        changed = np.ones(xp.shape, dtype=bool)
+        if old is None: # nothing to compare with, write everything
+            self.conn.execute("DELETE FROM stats WHERE character_id = ?",
+                              (char_id,))
+        else:
+            n = min(len(old), len(xp))
+            if len(old) > len(xp): # truncated
+                self.conn.execute(
+                    "DELETE FROM stats WHERE character_id = ? AND year > ?",
+                    (char_id, first_year + len(xp) - 1))
+            changed[:n] = old[:n] != xp[:n]
+        rows, cols = np.nonzero(changed)
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO stats VALUES (?, ?, ?, ?, ?)",
+            zip([char_id] * len(rows),
+                (rows + first_year).tolist(),
+                [names[c] for c in cols.tolist()],
+                xp[rows, cols].tolist(),
+                values[rows, cols].tolist()))
+
+    def load_setting(self, name: str) -> Setting:
+        row = self.conn.execute("SELECT id, meta FROM settings WHERE name = ?",
+                                (name,)).fetchone()
+        if row is None:
+            raise KeyError(name)
+        setting_id, meta = row
+        setting = Setting.from_json(json.loads(meta), characters={})
+        rows = self.conn.execute(
+            "SELECT name FROM characters WHERE setting_id = ? ORDER BY id",
+            (setting_id,))
+        setting.characters = LazyCharacters(
+            [name for name, in rows],
+            lambda name: self.load_character(setting_id, name),
+            source=(self, setting_id),
+            spawn_rng=setting.spawn_rng)
+        return setting
+
+    def load_character(self, setting_id: int, name: str) -> Character:
+        row = self.conn.execute(
+            "SELECT id, meta, stats, art, first_year FROM characters "
+            "WHERE setting_id = ? AND name = ?", (setting_id, name)).fetchone()
+        if row is None:
+            raise KeyError(name)
+        char_id, meta_json, names, art, first_year = row
+        meta = json.loads(meta_json)
+        names = json.loads(names)
+        index = StatIndex(names, np.array(json.loads(art), dtype=bool))
+        xp = None
+        if "every" not in meta["history"]:
+            rows = np.array(self.conn.execute(
+                "SELECT year, stat, xp FROM stats WHERE character_id = ?",
+                (char_id,)).fetchall(), dtype=object)
+            years = rows[:, 0].astype(np.int64) - first_year
+            cols = np.array([index.cols[stat] for stat in rows[:, 1]])
+            xp = np.zeros((years.max() + 1, len(index)), dtype=np.int32)
+            xp[years, cols] = rows[:, 2].astype(np.int32)
+        char = Character.from_json(meta, index=index, history_xp=xp)
+        # replaying a checkpointed history is slow, it is compared by its
+        # metadata and fully written again if that changed. Loading
+        # renormalizes the prios, so the metadata is compared with what the
+        # loaded character writes
+        if xp is not None:
+            xp = xp.copy()
+        self._saved[char_id] = (self._meta_json(char), names, first_year, xp)
+        return char
+
+    # queries over every setting in the database, or only the named one.
+    # They return (setting name, character name, ...) rows
+
+    def group_members(self,
+                      category: str,
+                      group: str,
+                      setting: str = None,
+                      ) -> list:
+        query = ("SELECT s.name, c.name FROM memberships m "
+                 "JOIN characters c ON c.id = m.character_id "
+                 "JOIN settings s ON s.id = c.setting_id "
+                 "WHERE m.category = ? AND m.group_name = ?")
+        args = [category, group]
+        if setting is not None:
+            query += " AND s.name = ?"
+            args.append(setting)
+        return self.conn.execute(query, args).fetchall()
+
+    def stat_at_least(self,
+                      stat: str,
+                      year: int,
+                      value: int,
+                      setting: str = None,
+                      ) -> list:
+        # characters with a stat of at least value in year, with the value
+        query = ("SELECT s.name, c.name, st.value FROM stats st "
+                 "JOIN characters c ON c.id = st.character_id "
+                 "JOIN settings s ON s.id = c.setting_id "
+                 "WHERE st.stat = ? AND st.year = ? AND st.value >= ?")
+        args = [stat, year, value]
+        if setting is not None:
+            query += " AND s.name = ?"
+            args.append(setting)
+        return self.conn.execute(query + " ORDER BY st.value DESC",
+                                 args).fetchall()
@@ -0,0 +1,532 @@
+import numpy as np
+import json
+import copy
+import csv
+import re
+import os
+import threading
+import time
+import profiling
+from character import Character, CharacterSummary, StatIndex, xp2val_array
+from setting import Setting, LazyCharacters
+
+# binary setting files, a numpy .npz container with a small json header for
+# everything but the histories. Histories are stored as one flat int32 array
+# of all characters (years x stats) matrices, their stat columns as indices
+# into one shared table of stat names. JSON saves are still used for export
+# and interchange
+NPZ_FORMAT = "ars-manager-npz"
+NPZ_VERSION = 1
+
+def is_binary_save(path: str) -> bool:
+    return path.endswith(".npz")
+
+# copy of everything a save needs. Taking it is cheap, the slow part is
+# writing it, so it can be taken in the main thread and written in another
+# while the setting keeps changing. Loaded characters are copied as arrays
+# and their own dicts, characters that aren't loaded only as the function
+# building them from their saved payload, and everything is turned into what
+# is written by entries, in the writing thread
+class SettingSnapshot:
+    @profiling.profiled("SettingSnapshot")
+    def __init__(self, setting: Setting) -> None:
+        meta = setting.__json__()
+        chars = meta.pop("characters")
+        self.setting = copy.deepcopy(meta)
+        self._parts = []
+        for name in chars:
+            build = None
+            if isinstance(chars, LazyCharacters):
+                build = chars.unloaded_payload(name)
+            if build is None: # loaders without payloads build it here
+                get = getattr(chars, "get_transient", chars.__getitem__)
+                self._parts.append(character_entry(get(name)))
+            else:
+                self._parts.append(build)
+
+    def entries(self) -> list:
+        # (metadata, stat names, art mask, current xp, xp history matrix) of
+        # every character, the ones not loaded are built here
+        return [character_entry(part()) if callable(part) else part
+                for part in self._parts]
+
+def character_entry(char: Character) -> tuple:
+    # copies of what a save needs of a character, the stats are taken from
+    # the arrays instead
+    meta = {key: copy.copy(value) for key, value in char.json_meta().items()}
+    history = char.history
+    if history.replays: # small already, keep it in the metadata
+        meta["history"] = history.copy()
+        xp = None
+    else:
+        meta["history"] = {"first_year": history.first_year}
+        xp = history.matrix.copy()
+    index = char.stats.index
+    return meta, list(index.names), index.art.copy(), char.stats.xp.copy(), xp
+
+def write_npz(snapshot: SettingSnapshot, path: str, compress: bool = False):
+    names = []
+    name_ids = {}
+    char_meta = []
+    cols, art, col_offsets = [], [], [0]
+    xp, xp_offsets = [], [0]
+    # current stats are in the history and the history in the arrays
+    for meta, stat_names, stat_art, _, matrix in snapshot.entries():
+        for name in stat_names:
+            if name not in name_ids:
+                name_ids[name] = len(names)
+                names.append(name)
+        cols += [name_ids[name] for name in stat_names]
+        art += stat_art.tolist()
+        col_offsets.append(len(cols))
+        if matrix is None:
+            xp_offsets.append(xp_offsets[-1])
+        else:
+            xp.append(matrix.ravel())
+            xp_offsets.append(xp_offsets[-1] + matrix.size)
+        char_meta.append(meta)
+    header = {"format": NPZ_FORMAT,
+              "format_version": NPZ_VERSION,
+              "setting": snapshot.setting | {"characters": char_meta}}
+    savez = np.savez_compressed if compress else np.savez
+    with open(path, "wb") as file: # keeps numpy from adding .npz
+        savez(file,
+              header=np.frombuffer(json.dumps(header).encode(), np.uint8),
+              names=np.array(names, dtype=str),
+              cols=np.array(cols, dtype=np.int32),
+              art=np.array(art, dtype=bool),
+              col_offsets=np.array(col_offsets, dtype=np.int64),
+              xp=np.concatenate(xp) if xp else np.zeros(0, dtype=np.int32),
+              xp_offsets=np.array(xp_offsets, dtype=np.int64))
+
+def write_json(snapshot: SettingSnapshot, path: str):
+    chars = {}
+    for meta, stat_names, stat_art, stats, matrix in snapshot.entries():
+        xp = dict(zip(stat_names, stats.tolist()))
+        meta = meta | {"abilities": {name: xp[name] for name, art
+                                     in zip(stat_names, stat_art) if not art},
+                       "arts": {name: xp[name] for name, art
+                                in zip(stat_names, stat_art) if art}}
+        if matrix is not None:
+            meta["history"] = meta["history"] | {"stats": stat_names,
+                                                 "xp": matrix.tolist()}
+        chars[meta["name"]] = meta
+    with open(path, 'w') as file:
+        json.dump(snapshot.setting | {"characters": chars}, file, indent=2)
+
+@profiling.profiled("write_snapshot")
+def write_snapshot(snapshot: SettingSnapshot, path: str):
+    # written next to the target and renamed into place, so a crash while
+    # writing never leaves a broken save behind
+    tmp_path = path + ".tmp"
+    with profiling.stage("write"):
+        if is_binary_save(path):
+            write_npz(snapshot, tmp_path)
+        else:
+            write_json(snapshot, tmp_path)
+    with profiling.stage("replace"):
+        os.replace(tmp_path, path)
+    # everything journaled is in the file now
+    Journal(path).clear()
+
+def save_setting_npz(setting: Setting, path: str, compress: bool = False):
+    write_npz(SettingSnapshot(setting), path, compress)
+
+def read_npz(path: str) -> tuple[dict, dict]:
+    # header and arrays of a binary save, every array is read once
+    with np.load(path) as data:
+        arrays = {key: data[key] for key in data.files}
+    header = json.loads(arrays.pop("header").tobytes())
+    if header.get("format") != NPZ_FORMAT:
+        raise ValueError(f"{path} is not an Ars Manager setting")
+    return header, arrays
+
+def character_from_npz(meta: dict, arrays: dict, i: int) -> Character:
+    # the i:th character, its history is a view into the shared xp array
+    lo, hi = arrays["col_offsets"][i:i+2]
+    cols = arrays["cols"][lo:hi]
+    index = StatIndex(arrays["names"][cols].tolist(),
+                      arrays["art"][lo:hi])
+    history_xp = None
+    xlo, xhi = arrays["xp_offsets"][i:i+2]
+    if xhi > xlo:
+        history_xp = arrays["xp"][xlo:xhi].reshape(-1, len(index))
+    return Character.from_json(meta, index=index, history_xp=history_xp)
+
+def load_setting_npz(path: str) -> Setting:
+    header, arrays = read_npz(path)
+    serialized_setting = header["setting"]
+    chars = {}
+    for i, meta in enumerate(serialized_setting["characters"]):
+        chars[meta["name"]] = character_from_npz(meta, arrays, i)
+    return Setting.from_json(serialized_setting, characters=chars)
+
+# lazy loading. The histories are most of a save, so only the rest is parsed
+# and each character is built from its history when it is first used. Until
+# then the table is filled from a CharacterSummary of its current stats
+
+def summarize(meta: dict,
+              names: list,
+              art: np.ndarray,
+              xp: np.ndarray,
+              ) -> CharacterSummary:
+    # summary from character metadata and its current xp, in names order
+    values = xp2val_array(np.asarray(xp), art).tolist()
+    return CharacterSummary(
+        meta["name"],
+        meta["current_year"] - meta["char_input_year"] + meta["char_input_age"],
+        meta["characteristics"],
+        {name: v for name, v, a in zip(names, values, art) if not a},
+        {name: v for name, v, a in zip(names, values, art) if a},
+        meta["groups"])
+
+def load_setting_npz_lazy(path: str) -> Setting:
+    header, arrays = read_npz(path)
+    serialized_setting = header["setting"]
+    metas = serialized_setting["characters"]
+    order = {meta["name"]: i for i, meta in enumerate(metas)}
+
+    # characters get their own copy of the metadata, it is also the payload
+    def load(name: str) -> Character:
+        i = order[name]
+        return character_from_npz(copy.deepcopy(metas[i]), arrays, i)
+
+    def payload(name: str):
+        return lambda: load(name)
+
+    def summary(name: str) -> CharacterSummary:
+        i = order[name]
+        meta = metas[i]
+        lo, hi = arrays["col_offsets"][i:i+2]
+        names = arrays["names"][arrays["cols"][lo:hi]].tolist()
+        history = meta["history"]
+        if "every" in history: # only the last year is stored as is
+            if meta["current_year"] != history["last_year"]:
+                return None
+            xp = history["last"]
+        else:
+            xlo, xhi = arrays["xp_offsets"][i:i+2]
+            row = meta["current_year"] - history["first_year"]
+            xp = arrays["xp"][xlo:xhi].reshape(-1, len(names))[row]
+        return summarize(meta, names, arrays["art"][lo:hi], xp)
+
+    setting = Setting.from_json(serialized_setting, characters={})
+    setting.characters = LazyCharacters(list(order), load, summary,
+                                        spawn_rng=setting.spawn_rng,
+                                        payload=payload)
+    return setting
+
+HISTORY_KEY = '"history": '
+# a json string, skipped whole, or a bracket
+JSON_BRACKETS = re.compile(r'"(?:[^"\\]|\\.)*"|[\[\]{}]')
+
+def json_value_end(text: str, start: int) -> int:
+    # end of the json object or array at start, found in one pass keeping
+    # count of how deep in brackets it is, brackets in strings don't count
+    depth = 0
+    for match in JSON_BRACKETS.finditer(text, start):
+        bracket = match.group()
+        if bracket in "[{":
+            depth += 1
+        elif bracket in "]}":
+            depth -= 1
+            if depth == 0:
+                return match.end()
+    raise ValueError("Unterminated json value")
+
+def split_histories(text: str) -> tuple[str, list]:
+    # the json text with every history value replaced by null, and the raw
+    # text of those values in order
+    pieces, histories = [], []
+    pos = 0
+    while (key := text.find(HISTORY_KEY, pos)) >= 0:
+        start = key + len(HISTORY_KEY)
+        end = json_value_end(text, start)
+        pieces += [text[pos:start], "null"]
+        histories.append(text[start:end])
+        pos = end
+    pieces.append(text[pos:])
+    return "".join(pieces), histories
+
+def load_setting_json_lazy(path: str) -> Setting:
+    with open(path, 'r') as file:
+        text = file.read()
+    try:
+        stripped, histories = split_histories(text)
+        serialized_setting = json.loads(stripped)
+        metas = serialized_setting["characters"]
+        assert len(histories) == len(metas)
+    except (ValueError, AssertionError): # couldn't split it, load it all
+        return Setting.from_json(json.loads(text))
+    raw = dict(zip(metas, histories))
+    del text, stripped
+
+    # characters get their own copy of the metadata, it is also the payload
+    def load(name: str, text: str = None) -> Character:
+        text = raw[name] if text is None else text
+        return Character.from_json(copy.deepcopy(metas[name])
+                                   | {"history": json.loads(text)})
+
+    def payload(name: str):
+        text = raw[name] # dropped once it is loaded
+        return lambda: load(name, text)
+
+    def summary(name: str) -> CharacterSummary:
+        meta = metas[name]
+        stats = meta["abilities"] | meta["arts"]
+        art = np.array([name in meta["arts"] for name in stats], dtype=bool)
+        return summarize(meta, list(stats), art, list(stats.values()))
+
+    setting = Setting.from_json(serialized_setting, characters={})
+    setting.characters = LazyCharacters(list(metas), load, summary,
+                                        spawn_rng=setting.spawn_rng,
+                                        release=raw.pop,
+                                        payload=payload)
+    return setting
+
+def save_setting_json(setting: Setting, path: str):
+    write_json(SettingSnapshot(setting), path)
+
+def load_setting_json(path: str) -> Setting:
+    with open(path, 'r') as file:
+        return Setting.from_json(json.load(file))
+
+def save_setting_file(setting: Setting, path: str):
+    write_snapshot(SettingSnapshot(setting), path)
+
+@profiling.profiled("load_setting_file")
+def load_setting_file(path: str, lazy: bool = False) -> Setting:
+    if is_binary_save(path):
+        load = load_setting_npz_lazy if lazy else load_setting_npz
+    else:
+        load = load_setting_json_lazy if lazy else load_setting_json
+    setting = load(path)
+    Journal(path).replay(setting)
+    return setting
+
+# append only log of changes made since a setting file was last written, one
+# json record per line in a file next to it. Every record is numbered and the
+# setting file remembers the last number it includes, so records that are
+# already in it are skipped if the journal could not be removed
+class Journal:
+    def __init__(self, save_path: str) -> None:
+        self.path = save_path + ".journal"
+        self.n_records = 0
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as file:
+                self.n_records = sum(1 for _ in file)
+
+    def record(self, setting: Setting, change: dict) -> str:
+        # numbers the change and returns its line, to be written with write
+        setting.journal_seq += 1
+        self.n_records += 1
+        return json.dumps({"seq": setting.journal_seq} | change) + "\n"
+
+    def write(self, lines: list):
+        with open(self.path, 'a') as file:
+            file.writelines(lines)
+
+    def append(self, setting: Setting, change: dict):
+        self.write([self.record(setting, change)])
+
+    def records(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r') as file:
+            for line in file:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    return # last record only partly written, ignore it
+
+    def replay(self, setting: Setting):
+        for record in self.records():
+            if record["seq"] <= setting.journal_seq:
+                continue
+            setting.apply_change(record)
+            setting.journal_seq = record["seq"]
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.n_records = 0
+
+# writes snapshots and journal lines in a thread, in the order they were
+# given. A snapshot replaces everything still waiting before it as it already
+# contains those changes, and journal lines waiting next to each other are
+# written together. Waits delay seconds after a request before writing so
+# requests close together end up in one write
+class SaveWorker:
+    def __init__(self, delay: float = 0.2) -> None:
+        self.delay = delay
+        self.status = "Saved"
+        self._pending = [] # (path, snapshot) or (journal, line)
+        self._busy = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def save(self, snapshot: SettingSnapshot, path: str):
+        with self._cond:
+            self._pending = [(path, snapshot)]
+            self.status = "Unsaved changes"
+            self._cond.notify_all()
+
+    def journal(self, journal: Journal, line: str):
+        with self._cond:
+            self._pending.append((journal, line))
+            self.status = "Unsaved changes"
+            self._cond.notify_all()
+
+    def flush(self):
+        # blocks until everything requested so far is written
+        with self._cond:
+            while self._pending or self._busy:
+                self._cond.wait()
+
+    def _take(self) -> list:
+        # the first request and any journal lines for the same file after it
+        first = self._pending[0]
+        n = 1
+        if isinstance(first[0], Journal):
+            while n < len(self._pending) and self._pending[n][0] is first[0]:
+                n += 1
+        batch = self._pending[:n]
+        del self._pending[:n]
+        return batch
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+            time.sleep(self.delay)
+            with self._cond:
+                self._busy = True
+                self.status = "Saving..."
+                batch = self._take()
+            try:
+                target = batch[0][0]
+                if isinstance(target, Journal):
+                    target.write([line for _, line in batch])
+                else:
+                    write_snapshot(batch[0][1], target)
+                status = None
+            except Exception as e: # keep the worker alive, show what failed
+                status = f"Save failed: {e}"
+            with self._cond:
+                self._busy = False
+                if status is not None:
+                    self.status = status
+                elif not self._pending:
+                    self.status = "Saved"
+                self._cond.notify_all()
+
+# one row per character with its current values, sorted by name, see
+# export_history_csv for every year
+def export_characters_csv(setting: Setting, path: str):
+    with open(path, "w", newline="") as csvfile:
+        csvwriter = csv.writer(csvfile)
+        headers = setting.characters2csv_headers()
+        csvwriter.writerow(headers)
+        # first field should be name, we just hijacked it for current year
+        headers[0] = "Name"
+        dictwriter = csv.DictWriter(csvfile, fieldnames=headers)
+        chars = dict(sorted(setting.characters.items()))
+        for char in chars.values():
+            dictwriter.writerow(char.to_dict())
+
+HISTORY_LONG_HEADERS = ["Name", "Year", "Age", "Stat", "Value", "XP"]
+
+# characters of the setting sorted by name, only the ones in all the groups
+# (category -> group name) if given, found with the setting index. Lazy
+# characters are loaded one at a time without being kept
+def characters_in_groups(setting: Setting, groups: dict = None):
+    chars = setting.characters
+    lazy = isinstance(chars, LazyCharacters)
+    for name in setting.find_characters(groups=groups):
+        yield chars.get_transient(name) if lazy else chars[name]
+
+# (year, age, values, xp) for every simulated year of a character from first
+# to last that is not after its current year, values and xp in the order of
+# its stat index
+def history_years(char: Character, first: int = None, last: int = None):
+    history = char.history
+    first = history.first_year if first is None else \
+            max(first, history.first_year)
+    end = min(char.current_year, history.last_year)
+    if last is not None:
+        end = min(end, last)
+    if first > end:
+        return
+    art = char.stats.index.art
+    if history.replays: # rows are made one by one anyway
+        for year in range(first, end + 1):
+            xp = history[year].xp
+            yield year, char._get_age_at_year(year), \
+                  xp2val_array(xp, art).tolist(), xp.tolist()
+        return
+    xp = history.matrix[first - history.first_year:end - history.first_year + 1]
+    values = xp2val_array(xp, art)
+    for i, year in enumerate(range(first, end + 1)):
+        yield year, char._get_age_at_year(year), \
+              values[i].tolist(), xp[i].tolist()
+
+def history_rows_long(chars, first: int = None, last: int = None):
+    for char in chars:
+        names = char.stats.index.names
+        for year, age, values, xp in history_years(char, first, last):
+            for row in zip(names, values, xp):
+                yield (char.name, year, age) + row
+
+def history_rows_wide(chars,
+                      headers: list,
+                      first: int = None,
+                      last: int = None):
+    # headers are Name, Year, Age and then those of characters2csv_headers,
+    # stats without a column are left out like in export_characters_csv
+    col = {name: i for i, name in enumerate(headers)}
+    for char in chars:
+        row = [""]*len(headers)
+        row[0] = char.name
+        for name, value in char.characteristics.items():
+            if name in col:
+                row[col[name]] = value
+        for category, group in (char.groups or {}).items():
+            if category in col:
+                row[col[category]] = group
+        stat_cols = [(i, col[name])
+                     for i, name in enumerate(char.stats.index.names)
+                     if name in col]
+        for year, age, values, _ in history_years(char, first, last):
+            row[1], row[2] = year, age
+            for i, c in stat_cols:
+                row[c] = values[i]
+            yield list(row)
+
+# every simulated year of the characters to csv, either one row for each
+# character, year and stat (long) or one row for each character and year
+# with a column for each stat (wide). Rows are made as they are written so
+# memory stays flat for any size of setting. Returns the number of rows
+def export_history_csv(setting: Setting,
+                       path: str,
+                       first: int = None,
+                       last: int = None,
+                       groups: dict = None,
+                       wide: bool = False,
+                       ) -> int:
+    chars = characters_in_groups(setting, groups)
+    if wide:
+        headers = ["Name", "Year"] + setting.characters2csv_headers()[1:]
+        rows = history_rows_wide(chars, headers, first, last)
+    else:
+        headers = HISTORY_LONG_HEADERS
+        rows = history_rows_long(chars, first, last)
+    n = 0
+    with open(path, "w", newline="") as csvfile:
+        csvwriter = csv.writer(csvfile)
+        csvwriter.writerow(headers)
+        for row in rows:
+            csvwriter.writerow(row)
+            n += 1
+    return n
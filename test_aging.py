@@ -0,0 +1,67 @@
+import copy
+import numpy as np
+import char_generator as cg
+from aging import AgingEngine, age_in_pool
+
+# run with python -m pytest
+
+def make_mages(n: int) -> list:
+    mages = cg.create_mages([f"Magus {i}" for i in range(n)], seed=1220)
+    for i, mage in enumerate(mages):
+        mage.rng = np.random.default_rng([1220, i])
+    names = mages[1].stats.index.names
+    mages[1].swap_stats(names[0], names[4])
+    return mages
+
+def histories(mages: list) -> dict:
+    return {mage.name: mage.history.matrix for mage in mages}
+
+# every character ages on its own rng, so how they are aged and with which
+# others doesn't change the result
+def test_aging_paths_agree():
+    mages = make_mages(6)
+    alone = copy.deepcopy(mages)
+    for mage in alone:
+        mage.set_to_year(1260)
+    expected = histories(alone)
+    together = copy.deepcopy(mages)
+    AgingEngine(together).age_to(1260)
+    some = copy.deepcopy(mages)[::-2]
+    AgingEngine(some).age_to(1260)
+    pool = copy.deepcopy(mages)
+    age_in_pool(pool, 1260, 1)
+    for aged in [together, some, pool]:
+        for name, matrix in histories(aged).items():
+            assert np.array_equal(matrix, expected[name])
+
+# the pool sends characters to the workers in chunks, more workers than one
+# still have to give what serial aging gives
+def test_pool_with_workers_matches_serial():
+    mages = make_mages(12)
+    serial = copy.deepcopy(mages)
+    for mage in serial:
+        mage.set_to_year(1260)
+    age_in_pool(mages, 1260, 2)
+    expected = histories(serial)
+    for name, matrix in histories(mages).items():
+        assert np.array_equal(matrix, expected[name])
+
+# the engine draws all characters of a year at once, that has to stay the
+# same as aging them one by one also for many characters, with unbatched and
+# checkpointed ones among them
+def test_engine_matches_alone_at_size():
+    mages = make_mages(200)
+    for mage in mages[::3]:
+        mage.batched = False
+    for mage in mages[1::5]:
+        mage.checkpoint_every = 10
+        mage.history = mage._new_history(mage.history.first_year, mage.stats)
+    alone = copy.deepcopy(mages)
+    for mage in alone:
+        mage.set_to_year(1270)
+    AgingEngine(mages).age_to(1270)
+    for mage, expected in zip(mages, alone):
+        assert mage.history.last_year == 1270
+        for year in range(1220, 1271, 7):
+            assert np.array_equal(mage.history[year].xp,
+                                  expected.history[year].xp)
@@ -0,0 +1,16 @@
+import benchmark
+
+# run with python -m pytest
+
+# a gated path that is in the baseline but wasn't measured fails the gate,
+# ungated ones and sizes that weren't run don't
+def test_compare_reports_missing_gated_paths():
+    gate = ["AgingEngine.age_to", "save json"]
+    baseline = {("AgingEngine.age_to", 100): [1.0, 1.0, 1.0],
+                ("save json", 100): [1.0, 1.0, 1.0],
+                ("save json", 1000): [9.0, 9.0, 9.0],
+                ("load json", 100): [1.0, 1.0, 1.0]}
+    current = {("AgingEngine.age_to", 100): [1.0, 1.0, 1.0]}
+    rows = benchmark.compare(baseline, current, 0.1, gate)
+    assert [row[:2] for row in rows if row[5]] == [("save json", 100)]
+    assert rows[-1][3] is None
@@ -0,0 +1,91 @@
+import json
+import numpy as np
+import pytest
+import char_generator as cg
+import setting # lets json.dumps use __json__
+from character import Character, philox
+
+# run with python -m pytest
+
+def make_mage(checkpoint_every: int = None) -> Character:
+    cg.rng = np.random.default_rng(1220)
+    mage = cg.create_mage_from_gen_vals("Test", cg.gen_mage_values(),
+                                        char_input_year=1220,
+                                        groups={},
+                                        checkpoint_every=checkpoint_every)
+    mage.rng = np.random.default_rng(1220)
+    return mage
+
+# swap_stats and rename_stat move stats between columns, a saved character
+# has to replay and keep aging with the columns as they were
+@pytest.mark.parametrize("checkpoint_every", [None, 10])
+def test_json_round_trip_after_swap(checkpoint_every):
+    mage = make_mage(checkpoint_every)
+    mage.set_to_year(1310)
+    names = mage.stats.index.names
+    mage.swap_stats(names[0], names[5])
+    mage.rename_stat(names[2], "Renamed")
+    loaded = Character.from_json(json.loads(json.dumps(mage)))
+    assert loaded.stats.index.names == mage.stats.index.names
+    for year in mage.history:
+        assert loaded.history[year].xp_dict() == mage.history[year].xp_dict()
+    mage.set_to_year(1340)
+    loaded.set_to_year(1340)
+    assert loaded.stats.xp_dict() == mage.stats.xp_dict()
+
+# reaging after new options redraws only the years after from_year, also
+# when they are replayed from checkpoints and after a save
+@pytest.mark.parametrize("checkpoint_every", [None, 10])
+def test_reage_keeps_earlier_years(checkpoint_every):
+    mage = make_mage(checkpoint_every)
+    mage.set_to_year(1280)
+    before = {year: mage.history[year].xp.copy() for year in mage.history}
+    assert mage.set_xp_options(0.3, 3.0, 0.7, 30)
+    mage.reage(from_year=1255)
+    for year in range(1220, 1256):
+        assert np.array_equal(mage.history[year].xp, before[year])
+    assert mage.history.last_year == 1280
+    assert not np.array_equal(mage.history[1280].xp, before[1280])
+    loaded = Character.from_json(json.loads(json.dumps(mage)))
+    for year in mage.history:
+        assert np.array_equal(loaded.history[year].xp, mage.history[year].xp)
+    assert loaded.budget == 30
+
+# aging a year at a time keeps the checkpoint spacing, a new rng starts a
+# new checkpoint at the last year
+def test_checkpoints_when_aged_year_by_year():
+    mage = make_mage(checkpoint_every=10)
+    whole = make_mage(checkpoint_every=10)
+    for year in range(1221, 1321):
+        mage.set_to_year(year)
+    whole.set_to_year(1320)
+    assert mage.history._ck_years == list(range(1220, 1321, 10))
+    assert json.dumps(mage) == json.dumps(whole)
+    mage.set_to_year(1325)
+    mage.rng = np.random.default_rng(1)
+    mage.set_to_year(1330)
+    assert mage.history._ck_years[-2:] == [1320, 1325]
+
+# known answers of Philox4x32-10 from Random123
+@pytest.mark.parametrize("counter, key, expected", [
+    ([0, 0, 0, 0], [0, 0],
+     [0x6627e8d5, 0xe169c58d, 0xbc57ac4c, 0x9b00dbd8]),
+    ([0xffffffff]*4, [0xffffffff]*2,
+     [0x408f276d, 0x41c83b0e, 0xa20bc7c6, 0x6d5451fd]),
+    ([0x243f6a88, 0x85a308d3, 0x13198a2e, 0x03707344],
+     [0xa4093822, 0x299f31d0],
+     [0xd16cfe09, 0x94fdcceb, 0x5001e420, 0x24126ea1]),
+])
+def test_philox_known_answers(counter, key, expected):
+    words = philox(np.array(counter, dtype=np.uint32),
+                   np.array(key, dtype=np.uint32))
+    assert words.tolist() == expected
+
+# the chunk loop and the batched draw use the same stream words
+def test_batched_matches_chunk_loop():
+    batched = make_mage()
+    looped = make_mage()
+    looped.batched = False
+    batched.set_to_year(1300)
+    looped.set_to_year(1300)
+    assert np.array_equal(looped.history.matrix, batched.history.matrix)
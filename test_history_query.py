@@ -0,0 +1,33 @@
+import numpy as np
+import benchmark
+from character import CheckpointHistory
+from history_query import HistoryQuery
+
+# run with python -m pytest
+
+# checkpointed histories are replayed once per query, not once per stat,
+# and give the same columns as stored ones
+def test_checkpointed_histories_replay_once(monkeypatch):
+    stored = benchmark.make_setting(4)
+    setting = benchmark.make_setting(4)
+    for char in setting.characters.values():
+        char.checkpoint_every = 10
+        first = char.history.first_year
+        char.history = char._new_history(first, char.history[first].copy())
+        char.reage(age=False)
+    # more years than a checkpoint history caches
+    stored.set_year(1300)
+    setting.set_year(1300)
+    replays = []
+    replay = CheckpointHistory._replay
+    def counted(self, n, year):
+        replays.append(year)
+        return replay(self, n, year)
+    monkeypatch.setattr(CheckpointHistory, "_replay", counted)
+    query = HistoryQuery(setting)
+    expected = HistoryQuery(stored)
+    assert np.array_equal(query.column("Latin"), expected.column("Latin"))
+    n = len(replays)
+    assert n > 0
+    assert np.array_equal(query.column("Cr"), expected.column("Cr"))
+    assert len(replays) == n
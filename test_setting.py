@@ -0,0 +1,90 @@
+import pytest
+import benchmark
+import storage
+from setting import CharacterIndex
+
+# run with python -m pytest
+
+@pytest.fixture
+def lazy_setting(tmp_path):
+    path = str(tmp_path / "setting.json")
+    storage.save_setting_file(benchmark.make_setting(20), path)
+    return storage.load_setting_file(path, lazy=True)
+
+def scan(setting, groups: dict, stats: dict) -> list:
+    # what the index answers, by going through every character
+    found = []
+    for name, char in setting.characters.items():
+        values = CharacterIndex.stat_values(char)
+        if all(char.groups.get(category) == group
+               for category, group in groups.items()) and \
+           all(stat in values and
+               (low is None or values[stat] >= low) and
+               (high is None or values[stat] <= high)
+               for stat, (low, high) in stats.items()):
+            found.append(name)
+    return sorted(found)
+
+# the index gives what a scan gives, also after characters are added,
+# edited and removed and the year changes
+def test_index_matches_scan_through_changes():
+    setting = benchmark.make_setting(30)
+    house = setting.characters["Magus 0"].groups["House"]
+    queries = [({"House": house}, {}),
+               ({}, {"Magic Theory": (3, None)}),
+               ({"Tribunal": "Tribunal 1"}, {"Latin": (None, 4),
+                                             "Int": (0, None)})]
+    def check():
+        for groups, stats in queries:
+            assert setting.find_characters(groups, stats) == \
+                   scan(setting, groups, stats)
+    check()
+    new = benchmark.make_mage(seed=7)
+    new.name = "New"
+    new.groups = {"House": house, "Tribunal": "Tribunal 1"}
+    setting.add_character(new)
+    check()
+    assert "New" in setting.find_characters({"House": house})
+    setting.characters["Magus 1"].swap_stats("Latin", "Magic Theory")
+    setting.characters["Magus 3"].groups["House"] = house
+    setting.character_edited("Magus 1")
+    setting.character_edited("Magus 3")
+    check()
+    setting.remove_character("Magus 0")
+    check()
+    setting.add_years(15)
+    check()
+
+# lazily loaded characters are indexed from their summaries
+def test_index_keeps_setting_unloaded(lazy_setting):
+    setting = lazy_setting
+    found = setting.find_characters({"House": "House 2"},
+                                    {"Magic Theory": (0, None)})
+    assert "Magus 2" in found
+    for name in setting.characters:
+        row = setting.character_row(name)
+        assert (name in found) == (row.groups["House"] == "House 2")
+    assert setting.characters.loaded() == {}
+
+# renaming a stat checks the other characters and changes softcaps through
+# the index and deferred fixes, without loading the whole setting
+def test_rename_keeps_setting_unloaded(lazy_setting, tmp_path):
+    setting = lazy_setting
+    char = setting.characters["Magus 3"]
+    char.rename_stat("Latin", "Lingua")
+    setting.character_edited("Magus 3")
+    assert setting.stat_in_use("Latin", besides="Magus 3")
+    assert setting.stat_in_use("Lingua")
+    assert not setting.stat_in_use("Lingua", besides="Magus 3")
+    setting.set_softcap("Lingua", 5)
+    setting.set_softcap("Latin", None)
+    assert list(setting.characters.loaded()) == ["Magus 3"]
+    assert char.softcapped_stats["Lingua"] == 5
+    assert setting.characters["Magus 5"].softcapped_stats["Lingua"] == 5
+    assert "Latin" not in setting.characters["Magus 5"].softcapped_stats
+    path = str(tmp_path / "saved.json")
+    storage.save_setting_file(setting, path)
+    saved = storage.load_setting_file(path)
+    for name, saved_char in saved.characters.items():
+        assert saved_char.softcapped_stats["Lingua"] == 5
+        assert "Latin" not in saved_char.softcapped_stats
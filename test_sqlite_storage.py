@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+import benchmark
+from sqlite_storage import SqliteStore
+
+# run with python -m pytest
+
+@pytest.fixture
+def store(tmp_path):
+    store = SqliteStore(str(tmp_path / "settings.db"))
+    yield store
+    store.close()
+
+def same_stats(a, b) -> bool:
+    return a.stats.index.names == b.stats.index.names and \
+           np.array_equal(a.history.matrix, b.history.matrix)
+
+# characters come back lazily with the same histories, also checkpointed ones
+def test_round_trip_loads_lazily(store):
+    setting = benchmark.make_setting(6)
+    char = setting.characters["Magus 2"]
+    char.checkpoint_every = 10
+    first = char.history.first_year
+    char.history = char._new_history(first, char.history[first].copy())
+    char.reage(age=True)
+    store.save_setting(setting)
+    loaded = store.load_setting(setting.name)
+    assert store.setting_names() == [setting.name]
+    assert loaded.characters.loaded() == {}
+    assert list(loaded.characters) == list(setting.characters)
+    for name, char in setting.characters.items():
+        assert same_stats(loaded.characters[name], char)
+
+# saving again only writes what changed since the characters were loaded
+def test_save_writes_only_changes(store):
+    setting = benchmark.make_setting(6)
+    store.save_setting(setting)
+    loaded = store.load_setting(setting.name)
+    char = loaded.characters["Magus 1"]
+    before = store.conn.total_changes
+    store.save_setting(loaded)
+    assert store.conn.total_changes - before == 1 # the setting row
+    char.history[char.history.last_year].xp[0] += 100
+    before = store.conn.total_changes
+    store.save_setting(loaded)
+    assert store.conn.total_changes - before == 2 # and one stat of one year
+    del loaded.characters["Magus 4"]
+    store.save_setting(loaded)
+    again = store.load_setting(setting.name)
+    assert "Magus 4" not in again.characters
+    assert same_stats(again.characters["Magus 1"], char)
+
+# group and stat queries across settings use the indexed tables
+def test_queries_across_settings(store):
+    first = benchmark.make_setting(6)
+    second = benchmark.make_setting(4)
+    second.name = "other"
+    store.save_setting(first)
+    store.save_setting(second)
+    char = first.characters["Magus 3"]
+    house = char.groups["House"]
+    members = store.group_members("House", house)
+    assert ("bench 6", "Magus 3") in members
+    assert all(first.characters[name].groups["House"] == house
+               for setting, name in members if setting == "bench 6")
+    value = char.stats.value_dict()["Magic Theory"]
+    year = first.current_year
+    rows = store.stat_at_least("Magic Theory", year, value, setting="bench 6")
+    assert ("bench 6", "Magus 3", value) in rows
+    assert all(found >= value for _, _, found in rows)
+    assert {setting for setting, _, _ in
+            store.stat_at_least("Magic Theory", year, 0)} == \
+           {"bench 6", "other"}
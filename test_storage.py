@@ -0,0 +1,132 @@
+import json
+import numpy as np
+import pytest
+import benchmark
+import storage
+
+# run with python -m pytest
+
+def make_setting():
+    # stored and checkpointed histories, and a character with swapped columns
+    setting = benchmark.make_setting(12)
+    chars = list(setting.characters.values())
+    chars[1].swap_stats("Latin", "Magic Theory")
+    for char in chars[2::4]:
+        char.checkpoint_every = 10
+        first = char.history.first_year
+        char.history = char._new_history(first, char.history[first].copy())
+        char.reage(age=True)
+    return setting
+
+def saved_characters(path: str) -> dict:
+    setting = storage.load_setting_file(path)
+    return {name: json.dumps(char)
+            for name, char in setting.characters.items()}
+
+# a binary save loads the same characters as a json save, fully or lazily
+@pytest.mark.parametrize("lazy", [False, True])
+def test_npz_round_trip(tmp_path, lazy):
+    setting = make_setting()
+    json_path = str(tmp_path / "setting.json")
+    npz_path = str(tmp_path / "setting.npz")
+    storage.save_setting_file(setting, json_path)
+    storage.save_setting_file(setting, npz_path)
+    expected = storage.load_setting_file(json_path)
+    loaded = storage.load_setting_file(npz_path, lazy=lazy)
+    assert loaded.current_year == expected.current_year
+    assert list(loaded.characters) == list(expected.characters)
+    for name, char in expected.characters.items():
+        if lazy: # the table is filled without loading the characters
+            row = loaded.character_row(name)
+            if not char.history.replays:
+                assert row.abilities | row.arts == char.stats.value_dict()
+        assert json.dumps(loaded.characters[name]) == json.dumps(char)
+
+# histories of a binary save are views into the loaded arrays, stat names
+# are stored once
+def test_npz_histories_are_views(tmp_path):
+    path = str(tmp_path / "setting.npz")
+    storage.save_setting_file(make_setting(), path)
+    header, arrays = storage.read_npz(path)
+    assert len(set(arrays["names"].tolist())) == len(arrays["names"])
+    for i, meta in enumerate(header["setting"]["characters"]):
+        char = storage.character_from_npz(meta, arrays, i)
+        assert char.history.replays or \
+               np.shares_memory(char.history.matrix, arrays["xp"])
+
+def test_npz_rejects_other_files(tmp_path):
+    path = str(tmp_path / "other.npz")
+    np.savez(path, header=np.frombuffer(b'{"format": "x"}', np.uint8))
+    with pytest.raises(ValueError):
+        storage.load_setting_file(path)
+
+def same_stats(a, b) -> bool:
+    # loading renormalizes the prios a little, the stats are kept exactly
+    return a.stats.index.names == b.stats.index.names and \
+           np.array_equal(a.history.matrix, b.history.matrix)
+
+# changes journaled after a save are replayed when it is loaded, records
+# the save already includes are skipped and a half written last record is
+# ignored
+def test_journal_replays_changes(tmp_path):
+    path = str(tmp_path / "setting.json")
+    setting = benchmark.make_setting(4)
+    storage.save_setting_file(setting, path)
+    journal = storage.Journal(path)
+    setting.add_years(5)
+    journal.append(setting, setting.year_change())
+    setting.characters["Magus 1"].swap_stats("Latin", "Magic Theory")
+    journal.append(setting, setting.character_change("Magus 1"))
+    loaded = storage.load_setting_file(path)
+    assert loaded.current_year == setting.current_year
+    assert same_stats(loaded.characters["Magus 1"],
+                      setting.characters["Magus 1"])
+    storage.save_setting_file(setting, path)
+    assert journal.n_records == 2 # the saves journal is another object
+    stale = json.dumps({"seq": 1, "op": "year", "year": 1221}) + "\n"
+    journal.write([stale, '{"seq": 99, "op": "ye'])
+    loaded = storage.load_setting_file(path)
+    assert loaded.journal_seq == setting.journal_seq
+    assert loaded.current_year == setting.current_year
+
+# the save worker writes journal lines and snapshots in order, a snapshot
+# clears the journal it includes
+def test_save_worker_writes_in_order(tmp_path):
+    path = str(tmp_path / "setting.npz")
+    setting = benchmark.make_setting(4)
+    storage.save_setting_file(setting, path)
+    worker = storage.SaveWorker(delay=0)
+    journal = storage.Journal(path)
+    setting.add_years(2)
+    worker.journal(journal, journal.record(setting, setting.year_change()))
+    worker.flush()
+    assert worker.status == "Saved"
+    assert len(list(journal.records())) == 1
+    assert storage.load_setting_file(path).current_year == \
+           setting.current_year
+    setting.add_years(2)
+    worker.save(storage.SettingSnapshot(setting), path)
+    worker.flush()
+    assert list(journal.records()) == []
+    assert storage.load_setting_file(path).current_year == \
+           setting.current_year
+
+# a snapshot of a lazily loaded setting copies the characters that aren't
+# loaded as their saved payload, without loading them, and writes the same
+# save as the fully loaded setting
+@pytest.mark.parametrize("ext", ["json", "npz"])
+def test_snapshot_of_lazy_setting(tmp_path, ext):
+    path = str(tmp_path / f"setting.{ext}")
+    storage.save_setting_file(benchmark.make_setting(20), path)
+    lazy = storage.load_setting_file(path, lazy=True)
+    lazy.characters["Magus 3"].swap_stats("Latin", "Magic Theory")
+    snapshot = storage.SettingSnapshot(lazy)
+    assert list(lazy.characters.loaded()) == ["Magus 3"]
+    lazy.characters["Magus 4"].rename_stat("Latin", "Lingua") # after it
+    copy_path = str(tmp_path / f"copy.{ext}")
+    storage.write_snapshot(snapshot, copy_path)
+    full = storage.load_setting_file(path)
+    full.characters["Magus 3"].swap_stats("Latin", "Magic Theory")
+    full_path = str(tmp_path / f"full.{ext}")
+    storage.save_setting_file(full, full_path)
+    assert saved_characters(copy_path) == saved_characters(full_path)